@@ -1,5 +1,11 @@
+from sys import version_info
+
 from .stream import Stream
 from .underscore import shortcut as _
 from .func import F
 
+if version_info >= (3, 6):
+    from .astream import AsyncStream
+    from .afunc import AsyncF
+
 __version__ = "0.4.3"
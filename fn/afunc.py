@@ -0,0 +1,117 @@
+"""Functions composition with coroutine stages (requires Python 3.6+).
+
+Usage example:
+
+>>> from fn import AsyncF
+>>> from fn.afunc import amap, in_executor
+>>> pipeline = AsyncF() >> fetch_urls >> (amap, fetch, 50) >> in_executor(parse) >> store
+>>> await pipeline(query)
+"""
+
+import asyncio
+
+from functools import partial
+from inspect import isawaitable
+from timeit import default_timer
+
+from .astream import _async_iter
+from .func import F, _ProfiledStage
+from .op import identity
+
+class AsyncF(F):
+    """Async version of ``fn.F``: calling composition returns coroutine,
+    result of each stage is awaited before passing it to the next one
+    if it's awaitable, so plain functions and coroutine functions can
+    be mixed in a single pipeline. Note, that composition should start
+    with AsyncF, i.e. AsyncF() >> fetch >> parse.
+    """
+
+    __slots__ = ()
+
+    async def __call__(self, *args, **kwargs):
+        """Overload apply operator"""
+        stages = iter(self._stages)
+        result = next(stages, identity)(*args, **kwargs)
+        if isawaitable(result):
+            result = await result
+        for f in stages:
+            result = f(result)
+            if isawaitable(result):
+                result = await result
+        return result
+
+    def compile(self):
+        """Generate single coroutine function that executes all
+        composed functions one by one without loop over stages
+        """
+        names = ["f%d" % i for i in range(len(self._stages))] or ["f0"]
+        lines = ["async def composition(*args, **kwargs):",
+                 "    result = %s(*args, **kwargs)" % names[0],
+                 "    if isawaitable(result): result = await result"]
+        for name in names[1:]:
+            lines.append("    result = %s(result)" % name)
+            lines.append("    if isawaitable(result): result = await result")
+        lines.append("    return result")
+
+        namespace = dict(zip(names, self._stages or (identity, )))
+        namespace["isawaitable"] = isawaitable
+        exec("\n".join(lines), namespace)
+        return namespace["composition"]
+
+    def _profiled(self, f, name, hook, count_items):
+        return _AsyncProfiledStage(f, name, hook, count_items)
+
+class _AsyncProfiledStage(_ProfiledStage):
+    """Profiled stage that stops timer when result is awaited"""
+
+    __slots__ = ()
+
+    async def __call__(self, *args, **kwargs):
+        start = default_timer()
+        result = self.f(*args, **kwargs)
+        if isawaitable(result):
+            result = await result
+        return self._record(default_timer() - start, result)
+
+async def _apply(f, el):
+    result = f(el)
+    if isawaitable(result):
+        result = await result
+    return result
+
+async def _amap(f, limit, iterable):
+    tasks, pending = [], set()
+    try:
+        async for el in _async_iter(iterable):
+            # bound number of elements that are processed at once
+            while limit is not None and len(pending) >= limit:
+                _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            task = asyncio.ensure_future(_apply(f, el))
+            tasks.append(task)
+            pending.add(task)
+        return [await task for task in tasks]
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+def amap(f, limit, iterable=None):
+    """Apply f (plain or coroutine function) to all elements of
+    iterable (or async iterable) concurrently, at most ``limit``
+    calls at the same time (no limit when None). Returns coroutine
+    that gives list of results in original order, or stage function
+    for AsyncF if iterable is not given: AsyncF() >> (amap, fetch, 50)
+    """
+    if iterable is None:
+        return partial(amap, f, limit)
+    return _amap(f, limit, iterable)
+
+def in_executor(f, executor=None):
+    """Return stage that runs plain function f in given executor
+    (default executor of event loop if None), so CPU-heavy stages
+    don't block event loop
+    """
+    async def stage(arg):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(executor, f, arg)
+    return stage
@@ -0,0 +1,152 @@
+"""Memoized lazy stream over async iterators (requires Python 3.6+)."""
+
+import asyncio
+
+from collections import deque
+from sys import maxsize as maxint
+
+class _SyncSource(object):
+    """Adapter to use plain iterable as a source of async stream"""
+
+    __slots__ = ("_iterator", )
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            raise StopAsyncIteration()
+
+def _async_iter(source):
+    if hasattr(source, "__aiter__"):
+        return source.__aiter__()
+    return _SyncSource(source)
+
+class AsyncStream(object):
+    """Async version of ``fn.Stream``: lazy-evaluated stream that
+    shares evaluated elements between all created async iterators.
+
+    Stream accepts async iterables, async generator functions and
+    plain iterables as sources through ``<<`` operator. Concurrent
+    awaiters of the same (not yet evaluated) element share a single
+    ``__anext__`` call to the underlying source.
+
+    Usage:
+
+    >>> from fn import AsyncStream
+    >>> s = AsyncStream() << fetch_pages << [last_page]
+    >>> async for page in s:
+    ...     process(page)
+    >>> first = await s.get(0)
+    >>> first = await s[0]
+    >>> async for page in s[10:20]:
+    ...     process(page)
+    """
+
+    __slots__ = ("_collection", "_origin", "_pending")
+
+    class _AsyncStreamIterator(object):
+
+        __slots__ = ("_stream", "_position")
+
+        def __init__(self, stream):
+            self._stream = stream
+            self._position = -1 # not started yet
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            self._position += 1
+            stream = self._stream
+            if (len(stream._collection) > self._position or
+                await stream._fill_to(self._position)):
+                return stream._collection[self._position]
+
+            raise StopAsyncIteration()
+
+    def __init__(self, *origin):
+        self._collection = []
+        # flat queue of pending sources, head one is consumed first
+        self._origin = deque([_SyncSource(origin)]) if origin else deque()
+        # task that is evaluating next element right now
+        self._pending = None
+
+    def __lshift__(self, rvalue):
+        source = rvalue() if callable(rvalue) else rvalue
+        self._origin.append(_async_iter(source))
+        return self
+
+    def cursor(self):
+        """Return position of next evaluated element"""
+        return len(self._collection)
+
+    async def _pull(self):
+        try:
+            while self._origin:
+                try:
+                    el = await self._origin[0].__anext__()
+                except StopAsyncIteration:
+                    self._origin.popleft()
+                    continue
+                self._collection.append(el)
+                return True
+            return False
+        finally:
+            self._pending = None
+
+    async def _fill_to(self, index):
+        while len(self._collection) <= index:
+            if self._pending is None:
+                self._pending = asyncio.ensure_future(self._pull())
+            # shield pulling task, so cancellation of one
+            # awaiter will not affect other ones
+            if not await asyncio.shield(self._pending):
+                return False
+        return True
+
+    async def _fill_all(self):
+        await self._fill_to(maxint - 1)
+
+    def __aiter__(self):
+        return self._AsyncStreamIterator(self)
+
+    async def get(self, index):
+        """Return element by given index, evaluate it if necessary"""
+        if index < 0:
+            # negative index makes sense only for finite
+            # stream, so all elements should be evaluated
+            await self._fill_all()
+        else:
+            await self._fill_to(index)
+        return self._collection[index]
+
+    async def _slice(self, index):
+        if (any(i is not None and i < 0 for i in (index.start, index.stop)) or
+                (index.start is None and index.step is not None and index.step < 0)):
+            # reversed slice without start begins from the last element
+            await self._fill_all()
+            indices = range(*index.indices(len(self._collection)))
+        else:
+            indices = range(*index.indices(maxint))
+
+        for i in indices:
+            if len(self._collection) <= i and not await self._fill_to(i):
+                return
+            yield self._collection[i]
+
+    def __getitem__(self, index):
+        """Return awaitable element for integer index
+        or lazy async stream for slice
+        """
+        if isinstance(index, int):
+            return self.get(index)
+        elif isinstance(index, slice):
+            if index.step == 0: raise ValueError("Step must not be 0")
+            return self.__class__() << self._slice(index)
+        raise TypeError("Invalid argument type")
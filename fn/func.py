@@ -1,5 +1,24 @@
+import os
+import pickle
+
+from collections import namedtuple, OrderedDict
+try:
+    from collections.abc import Iterator
+except ImportError:
+    from collections import Iterator
 from functools import partial, wraps
-from inspect import getargspec
+from hashlib import sha1
+from sys import version_info, getsizeof
+from tempfile import mkstemp
+from threading import Lock, Event
+from time import time
+from timeit import default_timer
+from types import FunctionType
+
+if version_info >= (3, 3):
+    from inspect import signature, Parameter
+else:
+    from inspect import getargspec, ismethod
 
 from .op import identity, flip
 
@@ -18,19 +37,40 @@ class F(object):
     15
     """
 
-    __slots__ = "f", 
+    __slots__ = "_stages", 
 
     def __init__(self, f = identity, *args, **kwargs):
-        self.f = partial(f, *args, **kwargs) if any([args, kwargs]) else f
+        f = partial(f, *args, **kwargs) if any([args, kwargs]) else f
+        # Composed functions are stored as a flat tuple of stages in the
+        # order of application instead of nested closures, so calling
+        # composition doesn't depend on its length in stack depth
+        if isinstance(f, F):
+            self._stages = f._stages
+        else:
+            self._stages = () if f is identity else (f, )
+
+    def __getstate__(self):
+        # composition is pickled as a list of its stages
+        return self._stages,
+
+    def __setstate__(self, state):
+        self._stages, = state
+
+    @property
+    def f(self):
+        """Function that is represented by this instance"""
+        if not self._stages: return identity
+        return self._stages[0] if len(self._stages) == 1 else self
 
     @classmethod
-    def __compose(cls, f, g):
-        """Produces new class intance that will 
-        execute given functions one by one. Internal
-        method that was added to avoid code duplication
-        in other methods.
-        """
-        return cls(lambda *args, **kwargs: f(g(*args, **kwargs)))
+    def __from_stages(cls, stages):
+        inst = cls.__new__(cls)
+        inst._stages = stages
+        return inst
+
+    @staticmethod
+    def __stages(f):
+        return f._stages if isinstance(f, F) else (f, )
 
     def __ensure_callable(self, f):
         """Simplify partial execution syntax. 
@@ -41,16 +81,160 @@ class F(object):
 
     def __rshift__(self, g):
         """Overload >> operator for F instances"""
-        return self.__class__.__compose(self.__ensure_callable(g), self.f)
+        return self.__from_stages(self._stages + self.__stages(self.__ensure_callable(g)))
 
     def __lshift__(self, g):
         """Overload << operator for F instances"""
-        return self.__class__.__compose(self.f, self.__ensure_callable(g))
+        return self.__from_stages(self.__stages(self.__ensure_callable(g)) + self._stages)
 
     def  __call__(self, *args, **kwargs):
         """Overload apply operator"""
-        return self.f(*args, **kwargs)
+        stages = iter(self._stages)
+        result = next(stages, identity)(*args, **kwargs)
+        for f in stages:
+            result = f(result)
+        return result
+
+    def compile(self):
+        """Generate single function that executes all composed functions
+        one by one without loop over stages, i.e. for F() >> f >> g:
+
+        def composition(*args, **kwargs):
+            result = f0(*args, **kwargs)
+            result = f1(result)
+            return result
+        """
+        if not self._stages: return identity
+
+        names = ["f%d" % i for i in range(len(self._stages))]
+        lines = ["def composition(*args, **kwargs):",
+                 "    result = %s(*args, **kwargs)" % names[0]]
+        lines.extend("    result = %s(result)" % name for name in names[1:])
+        lines.append("    return result")
+
+        namespace = dict(zip(names, self._stages))
+        exec("\n".join(lines), namespace)
+        return namespace["composition"]
+
+    def profile(self, hook=None, count_items=False):
+        """Return copy of composition that records for each stage number
+        of calls, total and max wall time and number of elements in
+        sized results. Results are passed to the next stage as is, unless
+        count_items is set: then iterators are wrapped with generator
+        to count elements while they're consumed. Optional
+        hook(name, elapsed, result) is called after each stage call,
+        i.e. to send metrics elsewhere. Original composition is not
+        changed, so there is no overhead without it.
+
+        >>> pipeline = (F() >> parse >> (filter, valid) >> store).profile()
+        >>> pipeline(data)
+        >>> print(pipeline.report())
+        """
+        stages = (s.f if isinstance(s, _ProfiledStage) else s for s in self._stages)
+        return self.__from_stages(tuple(self._profiled(f, "%d: %s" % (i, _stage_name(f)),
+                                                       hook, count_items)
+                                        for i, f in enumerate(stages)))
+
+    def _profiled(self, f, name, hook, count_items):
+        return _ProfiledStage(f, name, hook, count_items)
+
+    def stats(self):
+        """Return list of StageStats for profiled stages"""
+        return [s.stats() for s in self._stages if isinstance(s, _ProfiledStage)]
+
+    def report(self):
+        """Return text table with stats of profiled stages"""
+        lines = ["%-30s %8s %12s %12s %10s" % ("stage", "calls", "total", "max", "items")]
+        lines.extend("%-30s %8d %11.6fs %11.6fs %10d" % (name[:30], calls, total, max_, items)
+                     for name, calls, total, max_, items in self.stats())
+        return "\n".join(lines)
+
+StageStats = namedtuple("StageStats", "name calls total max items")
+
+def _stage_name(f):
+    if isinstance(f, partial):
+        return "%s(...)" % _stage_name(f.func)
+    return getattr(f, "__name__", None) or str(f)
+
+class _ProfiledStage(object):
+    """Stage wrapper that collects stats of composed function calls"""
+
+    __slots__ = ("f", "name", "hook", "count_items", "calls", "total", "max", "items")
+
+    def __init__(self, f, name, hook=None, count_items=False):
+        self.f, self.name, self.hook, self.count_items = f, name, hook, count_items
+        self.calls, self.total, self.max, self.items = 0, 0.0, 0.0, 0
 
+    def _counted(self, iterator):
+        for el in iterator:
+            self.items += 1
+            yield el
+
+    def _record(self, elapsed, result):
+        self.calls += 1
+        self.total += elapsed
+        if elapsed > self.max: self.max = elapsed
+        # iter() is never called here: i.e. it registers cursor of stream
+        if isinstance(result, Iterator):
+            if self.count_items:
+                result = self._counted(result)
+        else:
+            try:
+                self.items += len(result)
+            except TypeError: # not sized
+                pass
+
+        if self.hook is not None:
+            self.hook(self.name, elapsed, result)
+        return result
+
+    def __call__(self, *args, **kwargs):
+        start = default_timer()
+        result = self.f(*args, **kwargs)
+        return self._record(default_timer() - start, result)
+
+    def stats(self):
+        return StageStats(self.name, self.calls, self.total, self.max, self.items)
+
+
+if version_info >= (3, 3):
+    def _arity(func):
+        """Return names of positional arguments
+        and names of required keyword-only ones
+        """
+        positional, kwonly = [], []
+        for param in signature(func).parameters.values():
+            if param.kind in (Parameter.POSITIONAL_ONLY, Parameter.POSITIONAL_OR_KEYWORD):
+                positional.append(param.name)
+            elif param.kind == Parameter.KEYWORD_ONLY and param.default is Parameter.empty:
+                kwonly.append(param.name)
+        return tuple(positional), tuple(kwonly)
+else:
+    def _arity(func):
+        """Return names of positional arguments
+        and names of required keyword-only ones
+        """
+        bound, keywords = 0, set()
+        # follow decorated functions like inspect.signature does
+        while hasattr(func, "__wrapped__"):
+            func = func.__wrapped__
+        while isinstance(func, partial):
+            bound += len(func.args)
+            keywords.update(func.keywords or ())
+            func = func.func
+        if ismethod(func) and func.__self__ is not None:
+            bound += 1
+
+        spec = getargspec(func)
+        names = spec.args[bound:]
+        required = len(spec.args) - len(spec.defaults or ()) - bound
+        # arguments after one given by keyword can't be passed by position
+        # (so they're keyword-only ones, as inspect.signature shows them)
+        for i, name in enumerate(names):
+            if name in keywords:
+                kwonly = [n for n in names[i:required] if n not in keywords]
+                return tuple(names[:i]), tuple(kwonly)
+        return tuple(names), ()
 
 def curried(func):
     """A decorator that makes the function curried
@@ -65,20 +249,348 @@ def curried(func):
     15
     >>> sum5(1, 2, 3)(4, 5)
     15
+
+    Function is called as soon as all named positional arguments are
+    given (either by position or by keyword, including ones with default
+    values), as well as keyword-only ones without default values.
+    Signature is resolved once on decoration.
+    """
+    positional, kwonly = _arity(func)
+
+    def ready(args, kwargs):
+        if len(args) < len(positional):
+            for name in positional[len(args):]:
+                if name not in kwargs: return False
+        for name in kwonly:
+            if name not in kwargs: return False
+        return True
+
+    def applied(args, kwargs):
+        def _curried(*more, **morekwargs):
+            allargs = args + more if args else more
+            if kwargs:
+                allkwargs = kwargs.copy()
+                allkwargs.update(morekwargs)
+            else:
+                allkwargs = morekwargs
+            if ready(allargs, allkwargs):
+                return func(*allargs, **allkwargs)
+            return applied(allargs, allkwargs)
+        return _curried
+
+    return wraps(func)(applied((), None))
+
+
+CacheInfo = namedtuple("CacheInfo", "hits misses evictions size")
+
+_missing = object()
+
+class Unbounded(object):
+    """Cache policy for memoize that never evicts values.
+    Policy methods are always called under memoize lock, so
+    policy instance should not be shared between functions.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def put(self, key, value):
+        self._data[key] = value
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+class LRU(Unbounded):
+    """Evict least recently used value when cache has more than
+    maxsize values
+    """
+
+    def __init__(self, maxsize):
+        super(LRU, self).__init__()
+        self._data = OrderedDict()
+        self._weights = {}
+        self.limit = maxsize
+        self.total = 0
+
+    def weight(self, value):
+        return 1
+
+    def get(self, key, default=None):
+        value = self._data.pop(key, _missing)
+        if value is _missing: return default
+        # reinsert value to mark it as recently used
+        self._data[key] = value
+        return value
+
+    def put(self, key, value):
+        if key in self._data:
+            del self._data[key]
+            self.total -= self._weights[key]
+        self._data[key] = value
+        self._weights[key] = w = self.weight(value)
+        self.total += w
+        while self._data and self.total > self.limit:
+            old, _ = self._data.popitem(last=False)
+            self.total -= self._weights.pop(old)
+            self.evictions += 1
+
+    def clear(self):
+        self._data.clear()
+        self._weights.clear()
+        self.total = 0
+
+class Weighted(LRU):
+    """Keep total weight of cached values (computed by given function,
+    size in bytes of value object by default) under given limit,
+    least recently used values are evicted first
     """
-    @wraps(func)
-    def _curried(*args, **kwargs):
-        f = func
-        count = 0
-        while isinstance(f, partial):
-            if f.args:
-                count += len(f.args)
-            f = f.func
-
-        spec = getargspec(f)
-
-        if count == len(spec.args) - len(args):
-            return func(*args, **kwargs)
-
-        return curried(partial(func, *args, **kwargs))
-    return _curried
+
+    def __init__(self, limit, weight=getsizeof):
+        super(Weighted, self).__init__(limit)
+        self.weight = weight
+
+class LFU(Unbounded):
+    """Evict least frequently used value when cache has more than
+    maxsize values (least recently used one among equally used).
+    All operations are O(1): keys are grouped in buckets by use count.
+    """
+
+    def __init__(self, maxsize):
+        super(LFU, self).__init__()
+        self.maxsize = maxsize
+        self._buckets = {}
+        self._min = 0
+
+    def _touch(self, key, entry):
+        count = entry[1]
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[count]
+            if self._min == count: self._min = count + 1
+        entry[1] = count + 1
+        self._buckets.setdefault(count + 1, OrderedDict())[key] = None
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None: return default
+        self._touch(key, entry)
+        return entry[0]
+
+    def put(self, key, value):
+        entry = self._data.get(key)
+        if entry is not None:
+            entry[0] = value
+            self._touch(key, entry)
+            return
+        if self.maxsize < 1:
+            # nothing could be kept, as with LRU(0)
+            self.evictions += 1
+            return
+        if len(self._data) >= self.maxsize:
+            bucket = self._buckets[self._min]
+            old, _ = bucket.popitem(last=False)
+            if not bucket: del self._buckets[self._min]
+            del self._data[old]
+            self.evictions += 1
+        self._data[key] = [value, 1]
+        self._buckets.setdefault(1, OrderedDict())[key] = None
+        self._min = 1
+
+    def clear(self):
+        self._data.clear()
+        self._buckets.clear()
+        self._min = 0
+
+class TTL(Unbounded):
+    """Evict values after given number of seconds since they were
+    computed, optionally keep no more than maxsize values
+    (values that are closer to expiration are evicted first)
+    """
+
+    def __init__(self, seconds, maxsize=None, clock=time):
+        super(TTL, self).__init__()
+        self._data = OrderedDict()
+        self.seconds = seconds
+        self.maxsize = maxsize
+        self.clock = clock
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None: return default
+        if entry[0] <= self.clock():
+            del self._data[key]
+            self.evictions += 1
+            return default
+        return entry[1]
+
+    def put(self, key, value):
+        now = self.clock()
+        self._data.pop(key, None)
+        # values are ordered by expiration time
+        while self._data:
+            old = next(iter(self._data))
+            if self._data[old][0] > now and (self.maxsize is None or len(self._data) < self.maxsize):
+                break
+            del self._data[old]
+            self.evictions += 1
+        self._data[key] = (now + self.seconds, value)
+
+class _DiskStore(object):
+    """Pickled values in files named by hash of function name and key"""
+
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        digest = sha1(pickle.dumps((self.name, key), 2)).hexdigest()
+        return os.path.join(self.directory, digest)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                stored, value = pickle.load(f)
+        except Exception: # not stored, unpicklable key or broken file
+            return _missing
+        return value if stored == key else _missing
+
+    def put(self, key, value):
+        try:
+            path = self._path(key)
+            data = pickle.dumps((key, value), 2)
+        except Exception:
+            return
+        fd, tmp = mkstemp(dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        # file appears at once, so readers never see partial data
+        getattr(os, "replace", os.rename)(tmp, path)
+
+def _key_arg(arg):
+    # persistent data structures are compared by identity,
+    # so use elements to make equal structures hit the same entry
+    if type(arg).__module__.startswith("fn.immutable.") and hasattr(arg, "__iter__"):
+        return type(arg), tuple(_key_arg(el) for el in arg)
+    return arg
+
+def _make_key(args, kwargs):
+    return (tuple(_key_arg(arg) for arg in args),
+            tuple(sorted((k, _key_arg(v)) for k, v in kwargs.items())) if kwargs else ())
+
+def _code_digest(code, digest):
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode("utf-8"))
+    for const in code.co_consts:
+        # nested code objects have memory address in repr
+        if hasattr(const, "co_code"):
+            _code_digest(const, digest)
+        else:
+            digest.update(repr(const).encode("utf-8"))
+    return digest
+
+def _disk_name(func):
+    """Namespace of disk files for plain named function: qualified
+    name and hash of its code, so different functions never share
+    cached values. Raise TypeError for callables without such identity.
+    """
+    if (type(func) is not FunctionType or func.__name__ == "<lambda>" or
+            func.__closure__):
+        raise TypeError("memoize with disk needs explicit name for {0!r} "
+                        "(only plain named functions without closure "
+                        "have stable identity)".format(func))
+    name = getattr(func, "__qualname__", func.__name__)
+    digest = _code_digest(func.__code__, sha1()).hexdigest()
+    return "%s.%s:%s" % (func.__module__, name, digest)
+
+def memoize(func=None, policy=None, disk=None, name=None):
+    """A decorator that caches results of pure function by its arguments
+
+    Usage example:
+
+    >>> @memoize
+    ... def fib(n):
+    ...     return n if n < 2 else fib(n - 1) + fib(n - 2)
+    >>> @memoize(LRU(1000), disk="/var/cache/app", name="render_v1")
+    ... def render(page):
+    ...     ...
+    >>> render.stats()
+    CacheInfo(hits=0, misses=0, evictions=0, size=0)
+
+    Policy is one of Unbounded (default), LRU(maxsize), LFU(maxsize),
+    TTL(seconds, maxsize=None) or Weighted(limit, weight=sys.getsizeof).
+    Concurrent calls with the same arguments wait for single computation.
+    Values of fn.immutable data structures are compared by elements.
+    With disk directory given, values are also pickled to files there
+    and reused after restart (disk files are never evicted). Files are
+    separated by name (unique within directory), that is derived from
+    qualified name and code of plain functions and should be given
+    explicitly for other callables (lambdas, closures, F, partial).
+    Works with any callable, i.e. F compositions or curried functions.
+    """
+    if func is None or isinstance(func, Unbounded):
+        return partial(memoize, policy=policy if func is None else func,
+                       disk=disk, name=name)
+
+    policy = Unbounded() if policy is None else policy
+    if disk is not None and name is None:
+        name = _disk_name(func)
+    store = None if disk is None else _DiskStore(disk, name)
+    lock, inflight, counters = Lock(), {}, [0, 0]
+
+    def memoized(*args, **kwargs):
+        key = _make_key(args, kwargs)
+        while True:
+            with lock:
+                value = policy.get(key, _missing)
+                if value is not _missing:
+                    counters[0] += 1
+                    return value
+                event = inflight.get(key)
+                if event is None:
+                    inflight[key] = event = Event()
+                    break
+            # the same value is computed by other thread right now
+            event.wait()
+
+        try:
+            value = _missing if store is None else store.get(key)
+            if value is _missing:
+                value = func(*args, **kwargs)
+                if store is not None: store.put(key, value)
+                hit = 0
+            else:
+                hit = 1
+            with lock:
+                counters[1 - hit] += 1
+                policy.put(key, value)
+            return value
+        finally:
+            with lock:
+                del inflight[key]
+            event.set()
+
+    def stats():
+        with lock:
+            return CacheInfo(counters[0], counters[1], policy.evictions, len(policy))
+
+    def clear():
+        """Clear cached values (stored on disk are kept)"""
+        with lock:
+            policy.clear()
+
+    for attr in ("__module__", "__name__", "__doc__"):
+        if hasattr(func, attr): setattr(memoized, attr, getattr(func, attr))
+    memoized.__wrapped__ = func
+    memoized.stats = stats
+    memoized.clear = clear
+    return memoized
@@ -1,8 +1,34 @@
-from functools import partial
+from collections import deque
+from heapq import heappush, heappop
+from itertools import islice
+from operator import lt
 from fn.op import identity
 
 default_cmp = (lambda a,b: -1 if (a < b) else 1)
 
+class _Ordering(object):
+    """Comparator configuration shared by all nodes of the heap
+    (and all heaps derived from it) instead of per-node copies.
+    Without custom compare function keys are compared with native <.
+    """
+
+    __slots__ = ("keyfn", "cmpfn", "lt")
+
+    def __init__(self, key=None, cmp=None):
+        self.keyfn = key
+        self.cmpfn = cmp
+        self.lt = lt if cmp is None else (lambda a, b: cmp(a, b) < 0)
+
+    @classmethod
+    def get(cls, key=None, cmp=None):
+        if key is None and cmp is None: return _default_ordering
+        return cls(key, cmp)
+
+    def key(self, el):
+        return el if self.keyfn is None else self.keyfn(el)
+
+_default_ordering = _Ordering()
+
 class _MergeBased(object):
 
     def __nonzero__(self):
@@ -12,19 +38,70 @@ class _MergeBased(object):
         return self.__nonzero__()
 
     def __iter__(self):
-        """Extract elements one-by-one.
+        """Yield elements one-by-one in sorted order.
         Note, that list(*Heap()) gives you sorted list as result.
+
+        Instead of extracting elements one-by-one (which creates
+        new persistent heap on each step), walk through the heap
+        keeping frontier of not yet visited subheaps ordered by roots.
         """
-        curr = self
-        while curr:
-            r, curr = curr.extract()
-            yield r
+        frontier = [self] if self else []
+        while frontier:
+            h = heappop(frontier)
+            yield h.root
+            for sub in h._subheaps():
+                if sub: heappush(frontier, sub)
 
     def __lt__(self, other):
         if (not self) and (not other): return False
         if not self: return True
         if not other: return False
-        return self.cmpfn(self.keyfn(self.root), self.keyfn(other.root)) < 0
+        return self._ordering.lt(self._key, other._key)
+
+    @property
+    def keyfn(self):
+        return self._ordering.keyfn or identity
+
+    @property
+    def cmpfn(self):
+        return self._ordering.cmpfn or default_cmp
+
+    def _empty(self):
+        return self._node(None, None)
+
+    def to_sorted_list(self):
+        """Returns list of all heap elements in sorted order"""
+        return list(self)
+
+    def nsmallest(self, k):
+        """Returns list of k first elements in sorted order
+        (or all elements if heap contains less than k)
+        """
+        return list(islice(self, k))
+
+    @classmethod
+    def merge_all(cls, heaps):
+        """Merge given heaps into a single one. Heaps are merged
+        pairwise (round by round) to keep resulting heap balanced.
+        Returns the first given heap (with its ordering) if there is
+        nothing to merge or plain empty heap if no heaps are given.
+        """
+        heaps = list(heaps)
+        queue = deque(h for h in heaps if h)
+        if not queue: return heaps[0] if heaps else cls()
+        while len(queue) > 1:
+            queue.append(queue.popleft().union(queue.popleft()))
+        return queue[0]
+
+    @classmethod
+    def from_iterable(cls, iterable, key=None, cmp=None):
+        """Build heap from given iterable in O(n) using pairwise
+        merging of singletons instead of n consecutive inserts.
+        """
+        empty = cls(key=key, cmp=cmp)
+        keyfn = empty._ordering.key
+        h = cls.merge_all(empty._node(el, keyfn(el)) for el in iterable)
+        return h if h else empty
 
 class SkewHeap(_MergeBased):
     """A skew heap (or self-adjusting heap) is a heap data structure
@@ -62,20 +139,28 @@ class SkewHeap(_MergeBased):
     (20, <fn.immutable.heap.SkewHeap object at 0x10b14c1b0>)
     """
 
-    __slots__ = ("root", "left", "right", "keyfn", "cmpfn", "_make_heap")
+    __slots__ = ("root", "left", "right", "_key", "_ordering")
 
     def __init__(self, el=None, left=None, right=None, key=None, cmp=None):
         """Creates skew heap with one element (or empty one)"""
         self.root = el
         self.left = left
         self.right = right
-        self.keyfn = key or identity
-        self.cmpfn = cmp or default_cmp
-        self._make_heap = partial(self.__class__, key=self.keyfn, cmp=self.cmpfn)        
+        self._ordering = _Ordering.get(key, cmp)
+        self._key = None if el is None else self._ordering.key(el)
+
+    def _node(self, el, elkey, left=None, right=None):
+        """Creates heap node sharing ordering with self,
+        element key should be already computed
+        """
+        h = SkewHeap.__new__(self.__class__)
+        h.root, h._key, h.left, h.right = el, elkey, left, right
+        h._ordering = self._ordering
+        return h
 
     def insert(self, el):
         """Returns new skew heap with additional element"""
-        return self._make_heap(el).union(self)
+        return self._node(el, self._ordering.key(el)).union(self)
 
     def extract(self):
         """Returns pair of values:
@@ -84,17 +169,30 @@ class SkewHeap(_MergeBased):
 
         Or None and empty heap if self is an empty heap.
         """
-        if not self: return None, self._make_heap()
-        return self.root, self.left.union(self.right) if self.left else self._make_heap()
+        if not self: return None, self._empty()
+        return self.root, self.left.union(self.right) if self.left else self._empty()
+
+    def _subheaps(self):
+        return self.left, self.right
 
     def union(self, other):
         """Merge two heaps and returns new one (skew merging)"""
-        if not self: return other
-        if not other: return self
-
-        if self < other:
-            return self._make_heap(self.root, other.union(self.right), self.left)
-        return self._make_heap(other.root, self.union(other.right), other.left)
+        # Walk down both right spines iteratively (instead of recursing
+        # once per level), remembering (root, left) for each new node,
+        # then build merged heap bottom-up
+        h1, h2, spine, less = self, other, [], self._ordering.lt
+        while h1 and h2:
+            if less(h1._key, h2._key):
+                spine.append(h1)
+                h1, h2 = h2, h1.right
+            else:
+                spine.append(h2)
+                h2 = h2.right
+
+        merged = h1 if h1 else h2
+        for h in reversed(spine):
+            merged = self._node(h.root, h._key, merged, h.left)
+        return merged
 
 class PairingHeap(_MergeBased):
     """A pairing heap is either an empty heap, or a pair consisting of a root
@@ -135,7 +233,7 @@ class PairingHeap(_MergeBased):
     ('b', <fn.immutable.heap.PairingHeap object at 0x10b13f9b0>)
     """
 
-    __slots__ = ("root", "subs", "keyfn", "cmpfn", "_make_heap")
+    __slots__ = ("root", "subs", "_key", "_ordering")
 
     def __init__(self, el=None, subs=None, key=None, cmp=None):
         """Creates singlton from given element 
@@ -143,13 +241,21 @@ class PairingHeap(_MergeBased):
         """
         self.root = el
         self.subs = subs
-        self.keyfn = key or identity
-        self.cmpfn = cmp or default_cmp
-        self._make_heap = partial(self.__class__, key=self.keyfn, cmp=self.cmpfn)
+        self._ordering = _Ordering.get(key, cmp)
+        self._key = None if el is None else self._ordering.key(el)
+
+    def _node(self, el, elkey, subs=None):
+        """Creates heap node sharing ordering with self,
+        element key should be already computed
+        """
+        h = PairingHeap.__new__(self.__class__)
+        h.root, h._key, h.subs = el, elkey, subs
+        h._ordering = self._ordering
+        return h
 
     def insert(self, el):
         """Returns new pairing heap with additional element"""
-        return self.union(self._make_heap(el))
+        return self.union(self._node(el, self._ordering.key(el)))
 
     def extract(self):
         """Returns pair of values:
@@ -158,8 +264,14 @@ class PairingHeap(_MergeBased):
 
         Or None and empty heap if self is an empty heap.
         """
-        if not self: return None, self._make_heap()
-        return self.root, PairingHeap._pairing(self._make_heap, self.subs)
+        if not self: return None, self._empty()
+        return self.root, PairingHeap._pairing(self._empty, self.subs)
+
+    def _subheaps(self):
+        hs = self.subs
+        while hs is not None:
+            h, hs = hs
+            yield h
 
     def union(self, other):
         """Returns new heap as a result of merging two given
@@ -171,14 +283,29 @@ class PairingHeap(_MergeBased):
         if not self: return other
         if not other: return self
 
-        if self < other:
-            return self._make_heap(self.root, (other, self.subs))
-        return self._make_heap(other.root, (self, other.subs))
+        if self._ordering.lt(self._key, other._key):
+            return self._node(self.root, self._key, (other, self.subs))
+        return self._node(other.root, other._key, (self, other.subs))
 
     @staticmethod
     def _pairing(heap, hs):
+        """Standard two-pass pairing of subheaps list: merge subheaps
+        in pairs from left to right, than merge resulting heaps one
+        by one from right to left. Both passes are implemented as loops
+        to avoid recursion limit on heaps with long lists of subheaps.
+        """
         if hs is None: return heap()
-        (h1, tail) = hs
-        if tail is None: return h1
-        (h2, tail) = tail
-        return PairingHeap._pairing(heap, (h1.union(h2), tail))
+
+        pairs = []
+        while hs is not None:
+            h1, hs = hs
+            if hs is None:
+                pairs.append(h1)
+                break
+            h2, hs = hs
+            pairs.append(h1.union(h2))
+
+        merged = pairs.pop()
+        while pairs:
+            merged = pairs.pop().union(merged)
+        return merged
@@ -1,6 +1,7 @@
 from sys import version_info
 
-identity = lambda arg: arg
+def identity(arg):
+    return arg
 
 def _apply(f, args=None, kwargs=None):
     return f(*(args or []), **(kwargs or {}))
@@ -10,6 +11,22 @@ apply = apply if version_info[0] == 2 else _apply
 def call(f, *args, **kwargs):
     return f(*args, **kwargs)
 
+class _Flipped(object):
+    """Function that applies arguments to original one in reverse order.
+    Defined as a class (instead of closure) to be picklable.
+    """
+
+    __slots__ = "__flipback__",
+
+    def __init__(self, f):
+        self.__flipback__ = f
+
+    def __call__(self, a, b):
+        return self.__flipback__(b, a)
+
+    def __reduce__(self):
+        return self.__class__, (self.__flipback__, )
+
 def flip(f):
     """Return function that will apply arguments in reverse order"""
 
@@ -22,11 +39,7 @@ def flip(f):
     if flipper is not None:
         return flipper
 
-    def _flipper(a, b): 
-        return f(b, a)
-    
-    setattr(_flipper, "__flipback__", f)
-    return _flipper
+    return _Flipped(f)
 
 def curry(f, arg, *rest):
     return curry(f(arg), *rest) if rest else f(arg)
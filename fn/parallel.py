@@ -0,0 +1,88 @@
+"""Parallel stages for ``F`` pipelines built on top of ``concurrent.futures``
+(use ``futures`` backport package with Python 2).
+
+Usage example:
+
+>>> from concurrent.futures import ProcessPoolExecutor
+>>> from fn import F, _
+>>> from fn.parallel import pmap, pfilter
+>>> func = F() >> pmap(abs, executor=ProcessPoolExecutor, chunksize=100) >> pfilter(_ > 5) >> sum
+>>> func(range(-10, 10))
+70
+>>> func = F() >> (pmap, abs) >> list
+>>> func([-1, 2, -3])
+[1, 2, 3]
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
+from itertools import islice
+from multiprocessing import cpu_count
+
+def _map_chunk(f, chunk):
+    return [f(el) for el in chunk]
+
+def _filter_chunk(pred, chunk):
+    return [el for el in chunk if pred(el)]
+
+def _chunks(iterable, size):
+    it = iter(iterable)
+    return iter(lambda: list(islice(it, size)), [])
+
+def _parallel(task, f, iterable, executor, chunksize, ordered, inflight):
+    # executor could be given as a class (i.e. ProcessPoolExecutor),
+    # in this case it's created here and shut down after processing
+    owned = isinstance(executor, type)
+    if owned:
+        executor = executor()
+    inflight = inflight or 2 * cpu_count()
+
+    pending = deque() if ordered else set()
+    def results():
+        if ordered:
+            return pending.popleft().result()
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        pending.difference_update(done)
+        return [el for future in done for el in future.result()]
+
+    try:
+        for chunk in _chunks(iterable, chunksize):
+            future = executor.submit(task, f, chunk)
+            if ordered:
+                pending.append(future)
+            else:
+                pending.add(future)
+            # bound number of chunks that are processed at once
+            while len(pending) >= inflight:
+                for el in results():
+                    yield el
+
+        while pending:
+            for el in results():
+                yield el
+    finally:
+        for future in pending:
+            future.cancel()
+        if owned:
+            executor.shutdown()
+
+def pmap(f, iterable=None, executor=ThreadPoolExecutor, chunksize=1, ordered=True, inflight=None):
+    """Lazy parallel version of map: f is applied to chunks of
+    ``chunksize`` elements using given executor (instance or class
+    of ``concurrent.futures`` executor). At most ``inflight`` chunks
+    (2 * number of CPUs by default) are processed at the same time.
+    If ``ordered`` is False results are produced as soon as they're
+    ready. Returns stage function for F if iterable is not given.
+    """
+    if iterable is None:
+        return partial(pmap, f, executor=executor, chunksize=chunksize,
+                       ordered=ordered, inflight=inflight)
+    return _parallel(_map_chunk, f, iterable, executor, chunksize, ordered, inflight)
+
+def pfilter(pred, iterable=None, executor=ThreadPoolExecutor, chunksize=1, ordered=True, inflight=None):
+    """Lazy parallel version of filter, see ``pmap`` for details"""
+    if iterable is None:
+        return partial(pfilter, pred, executor=executor, chunksize=chunksize,
+                       ordered=ordered, inflight=inflight)
+    return _parallel(_filter_chunk, pred, iterable, executor, chunksize, ordered, inflight)
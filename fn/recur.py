@@ -1,4 +1,14 @@
-"""Provides decorator to deal with tail calls in recursive function."""
+"""Provides decorators to deal with deep recursion in functions."""
+
+import ast
+import inspect
+import textwrap
+
+from functools import partial, update_wrapper, wraps
+from threading import Lock
+from types import CodeType, FunctionType, GeneratorType, MethodType
+
+_CO_GENERATOR = 0x20
 
 class tco(object):
     """Provides a trampoline for functions that need one.
@@ -41,3 +51,404 @@ class tco(object):
             # impossible to use such function in tail calls loop?
             if callable(act): action = act
             kwargs = result[2] if len(result) > 2 else {}
+
+class _TailCall(object):
+    """Call that should be made by trampoline of tailrec function"""
+
+    __slots__ = ("func", "args", "kwargs")
+
+    def __init__(self, func, args, kwargs):
+        self.func, self.args, self.kwargs = func, args, kwargs
+
+def _tailcall(f):
+    """Return function that makes call of tailrec function (or method)
+    by trampoline of the caller, None for other callables (they're
+    called as usual, right from the caller frame)
+    """
+    if type(f) is FunctionType:
+        raw = f.__dict__.get("__tailrec__")
+        if raw is not None:
+            return partial(_deferred, raw, ())
+    elif type(f) is MethodType and f.__self__ is not None:
+        raw = getattr(f.__func__, "__tailrec__", None)
+        if type(raw) is FunctionType:
+            return partial(_deferred, raw, (f.__self__, ))
+    return None
+
+def _deferred(raw, bound, *args, **kwargs):
+    return _TailCall(raw, bound + args, kwargs)
+
+def _cell(value):
+    return (lambda: value).__closure__[0]
+
+def _param_names(args):
+    """Names of positional arguments or None for other signatures"""
+    if (args.vararg or args.kwarg or getattr(args, "kwonlyargs", None)
+            or getattr(args, "posonlyargs", None)):
+        return None
+    # Python 2 uses Name nodes for arguments
+    return [getattr(arg, "arg", None) or arg.id for arg in args.args]
+
+class _TailCallsRewriter(object):
+    """Rewrite tail calls in function body: self calls (if possible)
+    are replaced with assignment of arguments and "continue" of
+    the loop over whole body, all others are made by trampoline
+    """
+
+    def __init__(self, name, self_call, params, defaults, local_names=(), builtins=()):
+        self.name = name
+        self.builtins = builtins
+        self.self_call = self_call
+        self.params = params
+        self.defaults = defaults
+        # other locals are unbound on each new iteration, as in new call
+        self.reset = [ast.parse("try:\n    del %s\nexcept NameError:\n    pass" % local).body[0]
+                      for local in local_names]
+        self.loops = 0
+        self.trampolined = 0
+
+    def rewrite(self, body, in_loop=False):
+        result = []
+        for stmt in body:
+            result.extend(self.statement(stmt, in_loop))
+        return result
+
+    def statement(self, stmt, in_loop):
+        if isinstance(stmt, ast.Return):
+            return self.tail(stmt, in_loop)
+        if isinstance(stmt, ast.If):
+            stmt.body = self.rewrite(stmt.body, in_loop)
+            stmt.orelse = self.rewrite(stmt.orelse, in_loop)
+        elif isinstance(stmt, (ast.For, ast.While)):
+            # "continue" would refer to the inner loop
+            stmt.body = self.rewrite(stmt.body, True)
+            stmt.orelse = self.rewrite(stmt.orelse, True)
+        # calls inside of try/with blocks are not in tail position
+        return [stmt]
+
+    def tail(self, ret, in_loop):
+        value = ret.value
+        if isinstance(value, ast.IfExp):
+            # return a if c else b -> if c: return a else: return b
+            stmt = ast.If(test=value.test,
+                          body=self.tail(ast.copy_location(ast.Return(value=value.body), ret), in_loop),
+                          orelse=self.tail(ast.copy_location(ast.Return(value=value.orelse), ret), in_loop))
+            return [ast.copy_location(stmt, ret)]
+        if not isinstance(value, ast.Call):
+            return [ret]
+        if isinstance(value.func, ast.Name) and value.func.id in self.builtins:
+            # builtins are never tailrec ones, and some of them
+            # (locals, vars, eval) depend on the frame of the caller
+            return [ret]
+
+        is_self = (self.self_call and isinstance(value.func, ast.Name) and
+                   value.func.id == self.name)
+        if is_self and not in_loop:
+            bound = self.bind(value)
+            if bound is not None:
+                self.loops += 1
+                names, values = bound
+                assign = ast.Assign(
+                    targets=[ast.Tuple(elts=[ast.Name(id=p, ctx=ast.Store()) for p in names],
+                                       ctx=ast.Store())],
+                    value=ast.Tuple(elts=values, ctx=ast.Load()))
+                reset = [ast.copy_location(stmt, ret) for stmt in self.reset]
+                return ([ast.copy_location(assign, ret)] + reset +
+                        [ast.copy_location(ast.Continue(), ret)])
+
+        # f(args) -> (__tailcall(f) or f)(args)
+        self.trampolined += 1
+        target, result = value.func, [ret]
+        if not isinstance(target, ast.Name):
+            # callee is evaluated only once (before arguments)
+            assign = ast.Assign(targets=[ast.Name(id="__tailf", ctx=ast.Store())], value=target)
+            result.insert(0, ast.copy_location(assign, ret))
+            target = ast.Name(id="__tailf", ctx=ast.Load())
+        dispatch = ast.parse("__tailcall(f) or f", mode="eval").body
+        dispatch.values[0].args[0] = target
+        dispatch.values[1] = ast.Name(id=target.id, ctx=ast.Load())
+        for node in ast.walk(dispatch):
+            ast.copy_location(node, value)
+        value.func = dispatch
+        return result
+
+    def bind(self, call):
+        """Return names of all parameters of self call and expressions
+        for them (given arguments are kept in source order, so they're
+        evaluated as in real call), or None if call arguments can't be
+        matched statically
+        """
+        if self.params is None or getattr(call, "starargs", None) or getattr(call, "kwargs", None):
+            return None
+        if len(call.args) > len(self.params):
+            return None
+        names = self.params[:len(call.args)]
+        values = list(call.args)
+        for kw in call.keywords:
+            if kw.arg not in self.params or kw.arg in names:
+                return None
+            names.append(kw.arg)
+            values.append(kw.value)
+        if getattr(ast, "Starred", None) and any(isinstance(v, ast.Starred) for v in values):
+            return None
+        first_default = len(self.params) - len(self.defaults)
+        for i, param in enumerate(self.params):
+            if param in names:
+                continue
+            if i < first_default:
+                return None
+            names.append(param)
+            values.append(ast.parse("__defaults[%d]" % (i - first_default), mode="eval").body)
+        return names, values
+
+def tailrec(func):
+    """Optimize tail calls in normally written recursive function.
+
+    Function source is rewritten once on decoration: self calls in tail
+    position are turned into a loop over function body, other calls in
+    tail position (i.e. for mutual recursion) are made by trampoline,
+    so neither of them grows the stack.
+
+    Usage example:
+
+    @recur.tailrec
+    def fact(n, acc=1):
+        return acc if n <= 1 else fact(n - 1, acc * n)
+
+    @recur.tailrec
+    def is_even(n):
+        return True if n == 0 else is_odd(n - 1)
+
+    @recur.tailrec
+    def is_odd(n):
+        return False if n == 0 else is_even(n - 1)
+
+    Methods calls like self.method(...) in tail position are made
+    by trampoline as well. Note, that calls inside of try/with blocks
+    are not optimized and functions source code should be available.
+    """
+    code = getattr(func, "__code__", None)
+    if code is None or code.co_flags & _CO_GENERATOR:
+        raise TypeError("tailrec requires plain (not generator) function")
+    try:
+        lines, first_line = inspect.getsourcelines(func)
+    except (IOError, TypeError):
+        raise TypeError("tailrec can't get source code of %r" % func)
+    tree = ast.parse(textwrap.dedent("".join(lines)))
+    fdef = tree.body[0]
+    if not isinstance(fdef, ast.FunctionDef) or fdef.name != func.__name__:
+        raise TypeError("tailrec requires function defined with def statement")
+    fdef.decorator_list = []
+    ast.increment_lineno(fdef, first_line - 1)
+
+    name, freevars = func.__name__, code.co_freevars
+    # name refers to the function itself if it's module level one
+    # (for methods it's global name) or nested one (cell in enclosing scope),
+    # Python 2 functions have no qualified name, but methods are indented
+    self_call = (name in freevars or
+                 getattr(func, "__qualname__", None) == name or
+                 not hasattr(func, "__qualname__") and not lines[0][:1].isspace())
+    params = _param_names(fdef.args)
+    # loop can't be used if nested functions capture arguments
+    if any(isinstance(node, (ast.FunctionDef, ast.Lambda, ast.ClassDef, ast.GeneratorExp))
+           for node in ast.walk(fdef) if node is not fdef):
+        params = None
+    local_names = [var for var in code.co_varnames if var not in (params or ())]
+    scope = func.__globals__
+    builtins = scope.get("__builtins__", {})
+    builtins = set(getattr(builtins, "__dict__", builtins))
+    builtins = (set(var for var in builtins if var not in scope) -
+                set(code.co_varnames) - set(freevars) - set([name]))
+    rewriter = _TailCallsRewriter(name, self_call, params, func.__defaults__ or (),
+                                  local_names, builtins)
+
+    body = rewriter.rewrite(fdef.body)
+    if rewriter.loops:
+        loop = ast.parse("while True:\n    pass").body[0]
+        loop.body = body + [ast.Return(value=None)]
+        body = [ast.copy_location(loop, fdef.body[0])]
+    fdef.body = body
+
+    helpers = set(freevars) | set(["__tailcall", "__defaults"])
+    if self_call:
+        helpers.add(name)
+    elif name not in code.co_varnames:
+        # rewritten function is defined inside of factory, where
+        # its name is local, so it's referred as global explicitly
+        fdef.body.insert(0, ast.copy_location(ast.Global(names=[name]), fdef.body[0]))
+    factory = ast.parse("def __tailrec_factory(%s):\n    pass" % ", ".join(sorted(helpers)))
+    factory.body[0].body = [fdef]
+    ast.fix_missing_locations(factory)
+    module_code = compile(factory, inspect.getsourcefile(func) or "<tailrec>", "exec")
+    factory_code = [c for c in module_code.co_consts if isinstance(c, CodeType)][0]
+    raw_code = [c for c in factory_code.co_consts
+                if isinstance(c, CodeType) and c.co_name == name][0]
+
+    def trampoline(*args, **kwargs):
+        result = raw(*args, **kwargs)
+        while type(result) is _TailCall:
+            result = result.func(*result.args, **result.kwargs)
+        return result
+
+    cells = dict(zip(freevars, func.__closure__ or ()))
+    cells[name] = _cell(trampoline)
+    cells["__tailcall"] = _cell(_tailcall)
+    cells["__defaults"] = _cell(func.__defaults__)
+    raw = FunctionType(raw_code, func.__globals__, name, func.__defaults__,
+                       tuple(cells[var] for var in raw_code.co_freevars))
+    if getattr(func, "__kwdefaults__", None):
+        raw.__kwdefaults__ = func.__kwdefaults__
+
+    trampoline = wraps(func)(trampoline)
+    trampoline.__tailrec__ = raw
+    return trampoline
+
+
+class _Call(object):
+    """Request to evaluate stackless function with given arguments"""
+
+    __slots__ = ("func", "args", "kwargs")
+
+    def __init__(self, func, args, kwargs):
+        self.func, self.args, self.kwargs = func, args, kwargs
+
+_missing = object()
+
+def _evaluate(call):
+    """Run stackless function call: generators of all unfinished calls
+    are kept in a list (instead of Python stack), each generator is
+    resumed with result of the call it has yielded
+    """
+    stack, send, error = [], None, None
+    while True:
+        if call is not None:
+            # start evaluation of requested call
+            current, call = call, None
+            try:
+                value = current.func._start(current)
+            except Exception as e:
+                if not stack: raise
+                value, error = _missing, e
+            if type(value) is GeneratorType:
+                stack.append((value, current))
+                send = None
+            elif value is not _missing:
+                if not stack: return value
+                send = value
+
+        gen, current = stack[-1]
+        try:
+            if error is not None:
+                request, error = gen.throw(error), None
+            else:
+                request = gen.send(send)
+        except StopIteration as e:
+            # Python 3 generators could return result
+            request = getattr(e, "value", None)
+        except Exception as e:
+            # pass error to the caller
+            stack.pop()
+            if not stack: raise
+            error = e
+            continue
+        else:
+            if type(request) is _Call:
+                call = request
+                continue
+            # other yielded value is a result of the call
+            gen.close()
+
+        stack.pop()
+        current.func._finish(current, request)
+        if not stack: return request
+        send = request
+
+class _Stackless(object):
+
+    def __init__(self, func, cache=None):
+        self._func = func
+        self._cache = cache
+        # cache policies expect to be called under lock (see fn.func.memoize)
+        self._lock = Lock()
+        update_wrapper(self, func)
+
+    @staticmethod
+    def _key(call):
+        return call.args, tuple(sorted(call.kwargs.items())) if call.kwargs else ()
+
+    def _start(self, call):
+        if self._cache is not None:
+            with self._lock:
+                value = self._cache.get(self._key(call), _missing)
+            if value is not _missing: return value
+        value = self._func(*call.args, **call.kwargs)
+        if type(value) is not GeneratorType:
+            self._finish(call, value)
+        return value
+
+    def _finish(self, call, value):
+        if self._cache is not None:
+            with self._lock:
+                self._cache.put(self._key(call), value)
+
+    def __call__(self, *args, **kwargs):
+        return _evaluate(_Call(self, args, kwargs))
+
+    def call(self, *args, **kwargs):
+        """Return request of the call, that should be yielded
+        by stackless function to get result of the call
+        """
+        return _Call(self, args, kwargs)
+
+    def __get__(self, instance, owner):
+        return self if instance is None else _BoundStackless(self, instance)
+
+class _BoundStackless(object):
+    """Stackless function bound to instance (method)"""
+
+    __slots__ = ("_stackless", "_instance")
+
+    def __init__(self, stackless, instance):
+        self._stackless, self._instance = stackless, instance
+
+    def __call__(self, *args, **kwargs):
+        return self._stackless(self._instance, *args, **kwargs)
+
+    def call(self, *args, **kwargs):
+        return self._stackless.call(self._instance, *args, **kwargs)
+
+def stackless(func=None, memoize=False):
+    """Evaluate recursive function without growing Python stack.
+
+    Function should be written as a generator that yields requests
+    of recursive calls, f.call(*args) (to itself or other stackless
+    functions), and receives their results. Result is returned
+    (Python 3) or yielded as a value that is not a call request.
+    Plain f(*args) always evaluates the call at once (i.e. in helper
+    functions). Depth of recursion is limited only by memory.
+
+    With memoize=True results of all calls are cached by arguments
+    (any policy from fn.func could be given instead, i.e. LRU(1000)).
+
+    Usage example:
+
+    @recur.stackless(memoize=True)
+    def fib(n):
+        if n < 2:
+            yield n
+        else:
+            yield (yield fib.call(n - 1)) + (yield fib.call(n - 2))
+
+    @recur.stackless
+    def depth(tree):
+        depths = []
+        for sub in tree.children:
+            depths.append((yield depth.call(sub)))
+        yield 1 + max(depths or [0])
+    """
+    if func is None:
+        return partial(stackless, memoize=memoize)
+    if memoize is True:
+        from .func import Unbounded
+        memoize = Unbounded()
+    return _Stackless(func, memoize if memoize is not False else None)
@@ -2,19 +2,227 @@ from sys import version_info
 
 if version_info[0] == 2:
     from sys import maxint
+    from Queue import Queue, Full
 else:
     from sys import maxsize as maxint
+    from queue import Queue, Full
 
-from itertools import chain
-from .iters import map, range
+import os
+import pickle
+import shutil
+
+from array import array
+from collections import deque
+from mmap import mmap, ACCESS_READ
+from tempfile import mkdtemp
+from itertools import islice, takewhile, chain
+from threading import RLock, Thread, Event
+from weakref import WeakSet
+from .iters import range, map, filter, zip
+
+class _ReadAhead(object):
+    """Iterator that evaluates elements of given source in background
+    thread (or as a task submitted to given executor) and keeps up to
+    ``size`` evaluated elements in a queue. Producer starts on the first
+    request of an element and blocks when the queue is full. Exception
+    raised by source is reraised to consumer in place of the element.
+    """
+
+    __slots__ = ("_source", "_queue", "_executor", "_closed", "_started", "_done")
+
+    _VALUE, _ERROR, _DONE = range(3)
+
+    def __init__(self, source, size, executor=None):
+        self._source = source
+        self._queue = Queue(maxsize=size)
+        self._executor = executor
+        self._closed = Event()
+        self._started = False
+        self._done = False
+
+    @staticmethod
+    def _produce(source, queue, closed):
+        # note, that producer shouldn't refer to iterator object
+        # itself, otherwise it would never be collected (and closed)
+        def put(item):
+            while not closed.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        try:
+            for el in source:
+                if not put((_ReadAhead._VALUE, el)): return
+        except Exception as e:
+            put((_ReadAhead._ERROR, e))
+        else:
+            put((_ReadAhead._DONE, None))
+
+    def _start(self):
+        self._started = True
+        args = (self._source, self._queue, self._closed)
+        if self._executor is not None:
+            self._executor.submit(self._produce, *args)
+        else:
+            producer = Thread(target=self._produce, args=args)
+            producer.daemon = True
+            producer.start()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._done: raise StopIteration()
+        if not self._started: self._start()
+
+        kind, value = self._queue.get()
+        if kind == self._VALUE:
+            return value
+
+        self._done = True
+        if kind == self._ERROR:
+            raise value
+        raise StopIteration()
+
+    if version_info[0] == 2:
+        next = __next__
+
+    def close(self):
+        """Stop background producer"""
+        self._closed.set()
+
+    def __del__(self):
+        self.close()
+
+class _SpillStorage(object):
+    """Append-only storage for stream elements spilled to disk.
+    Elements are pickled into segment files (each one holds up to
+    SEGMENT_SIZE elements), offsets of elements are kept in memory
+    and random access reads are done through memory-mapped segments.
+    All files are removed when storage is closed (or collected).
+    """
+
+    __slots__ = ("_dir", "_offsets", "_maps", "_file", "_size")
+
+    SEGMENT_SIZE = 16384
+
+    def __init__(self, directory=None):
+        self._dir = mkdtemp(prefix="fn-stream-", dir=directory)
+        # for each segment: offsets of all elements and end of the last one
+        self._offsets = []
+        self._maps = []
+        # segment that is opened for writing
+        self._file = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _path(self, segment, directory=None):
+        return os.path.join(directory or self._dir, "segment-%06d" % segment)
+
+    def _open_segment(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self._path(len(self._offsets)), "wb")
+        self._offsets.append(array("l", [0]))
+        self._maps.append(None)
+
+    def extend(self, elements):
+        for el in elements:
+            if self._size % self.SEGMENT_SIZE == 0:
+                self._open_segment()
+            data = pickle.dumps(el, pickle.HIGHEST_PROTOCOL)
+            self._file.write(data)
+            offsets = self._offsets[-1]
+            offsets.append(offsets[-1] + len(data))
+            self._size += 1
+        if self._file is not None:
+            self._file.flush()
+
+    def __getitem__(self, index):
+        segment, position = divmod(index, self.SEGMENT_SIZE)
+        offsets = self._offsets[segment]
+        start, end = offsets[position], offsets[position + 1]
+        m = self._maps[segment]
+        if m is None or len(m) < end:
+            # last segment is still growing, so it is
+            # mapped once again when its end is requested
+            if m is not None: m.close()
+            with open(self._path(segment), "rb") as f:
+                m = self._maps[segment] = mmap(f.fileno(), 0, access=ACCESS_READ)
+        return pickle.loads(m[start:end])
+
+    def snapshot(self):
+        """Copy segment files into new directory (next to the storage
+        one), that is not removed with storage. Returns picklable
+        description of the copy for ``load``.
+        """
+        directory = mkdtemp(prefix="fn-checkpoint-", dir=os.path.dirname(self._dir))
+        for segment in range(len(self._offsets)):
+            shutil.copyfile(self._path(segment), self._path(segment, directory))
+        return {"dir": directory,
+                "offsets": [array("l", offsets) for offsets in self._offsets],
+                "size": self._size}
+
+    def load(self, snapshot):
+        """Fill empty storage with copy of files made by ``snapshot``"""
+        for segment, offsets in enumerate(snapshot["offsets"]):
+            shutil.copyfile(self._path(segment, snapshot["dir"]), self._path(segment))
+            self._offsets.append(array("l", offsets))
+            self._maps.append(None)
+        self._size = snapshot["size"]
+        if self._size % self.SEGMENT_SIZE:
+            # last segment is not full yet
+            self._file = open(self._path(len(self._offsets) - 1), "ab")
+
+    def close(self):
+        if self._dir is None: return
+        for m in self._maps:
+            if m is not None: m.close()
+        if self._file is not None:
+            self._file.close()
+        shutil.rmtree(self._dir, ignore_errors=True)
+        self._maps, self._file, self._dir = [], None, None
+
+    def __del__(self):
+        self.close()
 
 class Stream(object):
+    """Lazy-evaluated stream: each new element is evaluated "on demand"
+    and shared between all created iterators.
 
-    __slots__ = ("_last", "_collection", "_origin")
+    By default all evaluated elements are memoized. Given ``window``
+    (``Stream(window=N)``) stream releases elements that are older than
+    N last evaluated elements and already passed by all live iterators,
+    so iterating huge (or infinite) source doesn't grow memory without
+    bound. Access to released element raises IndexError.
+
+    Given ``prefetch`` (``Stream(prefetch=N)``) each source appended to
+    the stream is read ahead in background thread (or as a task of given
+    ``executor``, i.e. ``concurrent.futures.ThreadPoolExecutor``), that
+    keeps up to N elements evaluated ahead of the furthest iterator.
+    Reading starts when the first element of the source is requested.
+    Exception raised by source is reraised on access to the element at
+    corresponding position.
+
+    Given ``spill`` (``Stream(spill=N, spill_dir=None)``) elements older
+    than N last evaluated ones are pickled to append-only segment files
+    (in temporary directory inside of given ``spill_dir``) and are read
+    back through ``mmap`` on access. So it works as a memoized stream
+    over sources larger than RAM. Elements are spilled in batches, so up
+    to 2 * N + max(N, 1024) + 1 elements are kept in memory at once.
+    """
+
+    __slots__ = ("_collection", "_origin", "_offset", "_window", "_cursors",
+                 "_release_at", "_prefetch", "_executor", "_storage")
 
     class _StreamIterator(object):
-        
-        __slots__ = ("_stream", "_position")
+
+        __slots__ = ("_stream", "_position", "__weakref__")
 
         def __init__(self, stream):
             self._stream = stream
@@ -24,57 +232,369 @@ class Stream(object):
             # check if elements are available for next position
             # return next element or raise StopIteration
             self._position += 1
-            if (len(self._stream._collection) > self._position or 
-                self._stream._fill_to(self._position)):
-                return self._stream._collection[self._position]
+            stream = self._stream
+            if (stream._offset + len(stream._collection) > self._position or
+                stream._fill_to(self._position)):
+                if self._position < stream._offset:
+                    return stream._spilled(self._position)
+                return stream._collection[self._position - stream._offset]
 
             raise StopIteration()
 
+        def __iter__(self):
+            return self
+
         if version_info[0] == 2:
             next = __next__
 
-    def __init__(self, *origin):
+    def __init__(self, *origin, **kwargs):
+        window = kwargs.pop("window", None)
+        prefetch = kwargs.pop("prefetch", None)
+        executor = kwargs.pop("executor", None)
+        spill = kwargs.pop("spill", None)
+        spill_dir = kwargs.pop("spill_dir", None)
+        if kwargs:
+            raise TypeError("Unexpected keyword argument: %s" % ", ".join(kwargs))
+        if window is not None and window < 0:
+            raise ValueError("Window must not be negative")
+        if prefetch is not None and prefetch < 1:
+            raise ValueError("Prefetch must be positive")
+        if executor is not None and prefetch is None:
+            raise ValueError("Executor could be used only with prefetch")
+        if spill is not None and window is not None:
+            raise ValueError("Window and spill could not be used together")
+        if spill is not None and spill < 0:
+            raise ValueError("Spill must not be negative")
+
         self._collection = []
-        self._last = -1 # not started yet
-        self._origin = iter(origin) if origin else []
+        # flat queue of pending sources, head one is consumed first
+        self._origin = deque([iter(origin)]) if origin else deque()
+        # absolute index of the first element in collection
+        self._offset = 0
+        self._window = window
+        self._cursors = WeakSet() if window is not None else None
+        # spilling reuses releasing of elements out of window,
+        # but releases them to storage instead of dropping
+        self._storage = None
+        if spill is not None:
+            self._window = spill
+            self._storage = _SpillStorage(spill_dir)
+        self._release_at = self._release_chunk()
+        self._prefetch = prefetch
+        self._executor = executor
 
     def __lshift__(self, rvalue):
-        iterator = rvalue() if callable(rvalue) else rvalue
-        self._origin = chain(self._origin, iterator)
+        iterator = iter(rvalue() if callable(rvalue) else rvalue)
+        if self._prefetch is not None:
+            iterator = _ReadAhead(iterator, self._prefetch, self._executor)
+        self._origin.append(iterator)
         return self
 
     def cursor(self):
         """Return position of next evaluated element"""
-        return self._last + 1
+        return self._offset + len(self._collection)
 
     def _fill_to(self, index):
-        if self._last >= index:
-            return True
-
-        while self._last < index:
-            try:
-                n = next(self._origin)
-            except StopIteration:
+        # Note, that position of the last evaluated element is always
+        # derived from collection size: source could read this stream
+        # while the collection is being extended (i.e. fibonacci stream)
+        collection, origin = self._collection, self._origin
+        bounded = self._window is not None
+        while self._offset + len(collection) <= index:
+            if not origin:
                 return False
 
-            self._last += 1
-            self._collection.append(n)
+            need = index + 1 - self._offset - len(collection)
+            if bounded:
+                # don't evaluate more than next release allows
+                need = max(1, min(need, self._release_at - len(collection)))
+
+            if need == 1:
+                try:
+                    collection.append(next(origin[0]))
+                except StopIteration:
+                    origin.popleft()
+            else:
+                # pull whole chunk at once instead of one-by-one
+                size = len(collection)
+                collection.extend(islice(origin[0], need))
+                if len(collection) - size < need:
+                    origin.popleft()
+
+            if bounded and len(collection) >= self._release_at:
+                self._release(index)
 
         return True
 
+    def _fill_all(self):
+        """Evaluate all elements (never returns for infinite stream)"""
+        self._fill_to(maxint - 1)
+
+    def _release_chunk(self):
+        return max(self._window or 0, 1024)
+
+    def _release(self, index):
+        """Drop elements that are out of window and that were
+        already passed by all live iterators (requested element
+        is never dropped).
+        """
+        bound = min(self.cursor() - self._window, index)
+        for it in (self._cursors or ()):
+            # iterators that already missed released elements
+            # can't read them anyway, so they don't hold the window
+            if it._position + 1 < self._offset:
+                continue
+            # element on iterator position could be still requested
+            # by iterator that is filling stream right now
+            bound = min(bound, max(it._position, 0))
+
+        if bound > self._offset:
+            if self._storage is not None:
+                self._storage.extend(self._collection[:bound - self._offset])
+            del self._collection[:bound - self._offset]
+            self._offset = bound
+        # next release attempt is scheduled proportionally to the
+        # buffer size to keep amortized cost low when slow iterator
+        # holds back a long prefix
+        self._release_at = 2 * len(self._collection) + self._release_chunk()
+
     def __iter__(self):
-        return self._StreamIterator(self)
+        it = self._StreamIterator(self)
+        if self._cursors is not None:
+            self._cursors.add(it)
+        return it
+
+    def _released(self, index):
+        return IndexError("Stream element {0} was already released, "
+                          "first available index is {1}".format(index, self._offset))
+
+    def _spilled(self, index):
+        """Return element that is not in memory anymore"""
+        if self._storage is None:
+            raise self._released(index)
+        return self._storage[index]
+
+    def _slice(self, indices):
+        """Lazy view over given indices of this stream, reads evaluated
+        elements directly from collection
+        """
+        collection = self._collection
+        for index in indices:
+            if index - self._offset >= len(collection) and not self._fill_to(index):
+                return
+            if index < self._offset:
+                yield self._spilled(index)
+            else:
+                yield collection[index - self._offset]
 
     def __getitem__(self, index):
         if isinstance(index, int):
-            # todo: i'm not sure what to do with negative indices
-            if index < 0: raise TypeError("Invalid argument type")
-            self._fill_to(index)
+            if index < 0:
+                # negative index makes sense only for finite
+                # stream, so all elements should be evaluated
+                self._fill_all()
+                index += self.cursor()
+                if index < 0: raise IndexError("Stream index out of range")
+            else:
+                self._fill_to(index)
+            if index < self._offset:
+                return self._spilled(index)
+            index -= self._offset
         elif isinstance(index, slice):
-            low, high, step = index.indices(maxint)
-            if step == 0: raise ValueError("Step must not be 0")
-            return self.__class__() << map(self.__getitem__, range(low, high, step or 1))
+            if index.step == 0: raise ValueError("Step must not be 0")
+            if (any(i is not None and i < 0 for i in (index.start, index.stop)) or
+                    (index.start is None and index.step is not None and index.step < 0)):
+                # same as for negative index, reversed slice
+                # without start begins from the last element
+                self._fill_all()
+                low, high, step = index.indices(self.cursor())
+            else:
+                low, high, step = index.indices(maxint)
+            return self.__class__() << self._slice(range(low, high, step))
         else:
             raise TypeError("Invalid argument type")
 
         return self._collection.__getitem__(index)
+
+    def iter_from(self, position):
+        """Return iterator of this stream that starts from given
+        position (i.e. restored from checkpoint)
+        """
+        it = iter(self)
+        it._position = position - 1
+        return it
+
+    def checkpoint(self, source=None, cursors=()):
+        """Return picklable snapshot of the stream state: evaluated
+        elements, positions of given iterators and description of the
+        source position after the last evaluated element (``source``
+        value or result of ``source()`` if it's callable, i.e. file
+        offset). Stream could be rebuilt from the snapshot with
+        ``Stream.restore`` without evaluating elements once again.
+        Elements spilled to disk are not loaded into snapshot: segment
+        files are copied into new directory (next to spill ones) that
+        is referred by the snapshot and kept until it's removed by user
+        (``state["spilled"]["dir"]``).
+
+        >>> state = s.checkpoint(source=reader.tell, cursors=[it])
+        >>> pickle.dump(state, f)
+        ...
+        >>> state = pickle.load(f)
+        >>> s = Stream.restore(state, resume=lambda offset: read_from(offset))
+        >>> it = s.iter_from(state["cursors"][0])
+        """
+        if self._prefetch is not None:
+            raise ValueError("Stream with prefetch could not be checkpointed: "
+                             "source is evaluated ahead of the stream")
+        for it in cursors:
+            if it._stream is not self:
+                raise ValueError("Iterator doesn't belong to this stream")
+
+        return {"offset": self._offset,
+                "elements": list(self._collection),
+                "spilled": self._storage.snapshot() if self._storage is not None else None,
+                "cursors": [it._position + 1 for it in cursors],
+                "source": source() if callable(source) else source}
+
+    @classmethod
+    def restore(cls, state, resume=None, **kwargs):
+        """Build stream from the snapshot made by ``checkpoint``.
+        ``resume`` is called with the source description to get
+        iterable with elements after the snapshot ones. Other keyword
+        arguments are passed to stream constructor (snapshot of spilled
+        stream should be restored with ``spill`` as well).
+        """
+        s = cls(**kwargs)
+        spilled = state.get("spilled")
+        if spilled is not None:
+            if s._storage is None:
+                raise ValueError("Snapshot of spilled stream could be "
+                                 "restored only with spill")
+            s._storage.load(spilled)
+        s._offset = state["offset"]
+        s._collection.extend(state["elements"])
+        if resume is not None:
+            s << resume(state["source"])
+        return s
+
+    # Lazy combinators: each one returns new stream that memoizes its
+    # own results and pulls elements from this stream only when needed.
+    # Resulting streams refer to the same element objects.
+
+    def map(self, f):
+        """Stream of f(el) for each element of this stream"""
+        return self.__class__() << map(f, self)
+
+    def filter(self, pred):
+        """Stream of elements that satisfy given predicate"""
+        return self.__class__() << filter(pred, self)
+
+    def zip(self, *others):
+        """Stream of tuples with elements of this and other
+        streams (or iterables), stops on the shortest one
+        """
+        return self.__class__() << zip(self, *others)
+
+    def take_while(self, pred):
+        """Stream of elements from the beginning of this
+        stream while predicate is satisfied
+        """
+        return self.__class__() << takewhile(pred, self)
+
+    def flat_map(self, f):
+        """Stream of elements of iterables produced by f(el)"""
+        return self.__class__() << chain.from_iterable(map(f, self))
+
+    def scan(self, f, init=None):
+        """Stream of accumulated values: f(f(init, el0), el1)...
+        Starts with init if it's given, otherwise with the first element.
+
+        >>> list((Stream() << [1, 2, 3, 4]).scan(operator.add))
+        [1, 3, 6, 10]
+        >>> list((Stream() << [1, 2, 3, 4]).scan(operator.add, 10))
+        [10, 11, 13, 16, 20]
+        """
+        def scanner(it):
+            acc = init
+            if acc is None:
+                for acc in it:
+                    yield acc
+                    break
+                else:
+                    return
+            else:
+                yield acc
+            for el in it:
+                acc = f(acc, el)
+                yield acc
+        return self.__class__() << scanner(iter(self))
+
+class SharedStream(Stream):
+    """Thread-safe variant of Stream to share one (possibly expensive)
+    source between several threads. Exactly one thread evaluates new
+    elements under the lock while others wait for it or read elements
+    that are already evaluated without locking.
+
+    Note, that each thread should use its own iterator, single
+    iterator object is not supposed to be shared between threads.
+
+    Usage:
+
+    >>> from fn.stream import SharedStream
+    >>> s = SharedStream() << expensive_source()
+    >>> workers = [Thread(target=consume, args=(s, )) for _ in range(4)]
+    """
+
+    __slots__ = ("_lock", )
+
+    class _StreamIterator(Stream._StreamIterator):
+
+        __slots__ = ()
+
+        def __next__(self):
+            # collection could be shrunk by other thread in window
+            # mode, so reading is only safe under the lock
+            if self._stream._window is None:
+                return Stream._StreamIterator.__next__(self)
+            with self._stream._lock:
+                return Stream._StreamIterator.__next__(self)
+
+        if version_info[0] == 2:
+            next = __next__
+
+    def __init__(self, *origin, **kwargs):
+        # lock is reentrant to support streams that read themselves
+        self._lock = RLock()
+        super(SharedStream, self).__init__(*origin, **kwargs)
+
+    def __lshift__(self, rvalue):
+        with self._lock:
+            return super(SharedStream, self).__lshift__(rvalue)
+
+    def __iter__(self):
+        with self._lock:
+            return super(SharedStream, self).__iter__()
+
+    def __getitem__(self, index):
+        with self._lock:
+            return super(SharedStream, self).__getitem__(index)
+
+    def _fill_to(self, index):
+        if self._offset + len(self._collection) > index:
+            return True
+        with self._lock:
+            return super(SharedStream, self)._fill_to(index)
+
+    def checkpoint(self, source=None, cursors=()):
+        with self._lock:
+            return super(SharedStream, self).checkpoint(source, cursors)
+
+    def _slice(self, indices):
+        for index in indices:
+            with self._lock:
+                if not self._fill_to(index): return
+                if index < self._offset:
+                    el = self._spilled(index)
+                else:
+                    el = self._collection[index - self._offset]
+            yield el
@@ -1,38 +1,268 @@
 import re
+import keyword
+import numbers
 import operator
-import string
-import random
 
 from sys import version_info
-from itertools import repeat, count
+from functools import partial
+from itertools import repeat
 
-from .op import identity, apply, flip
-from .uniform import map, zip
-from .func import F
+from .op import flip, _Flipped
 
 div = operator.div if version_info[0] == 2 else operator.truediv
 
-letters = string.letters if version_info[0] == 2 else string.ascii_letters
-
-def _random_name():
-    return "".join(random.choice(letters) for _ in range(14))
+# Expression tree of underscore function is built from tuples:
+# ("arg",), ("const", value), ("binop", f, left, right, template),
+# ("unary", f, operand, template),
+# ("getattr", operand, name), ("getitem", operand, key),
+# ("call", operand, name, args, kwargs)
+ARG = ("arg",)
+
+_binary_syntax = {
+    operator.add: "+", operator.sub: "-", operator.mul: "*",
+    operator.floordiv: "//", operator.mod: "%", operator.pow: "**",
+    operator.lshift: "<<", operator.rshift: ">>",
+    operator.and_: "&", operator.or_: "|", operator.xor: "^",
+    operator.lt: "<", operator.le: "<=", operator.gt: ">",
+    operator.ge: ">=", operator.eq: "==", operator.ne: "!=",
+    # "/" is classic division for Python 2 (generated code
+    # doesn't inherit "from __future__ import division")
+    div: "/",
+}
+
+_unary_syntax = {operator.neg: "-", operator.pos: "+", operator.invert: "~"}
+
+_identifier = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+def _is_identifier(name):
+    return bool(_identifier.match(name)) and not keyword.iskeyword(name)
+
+class _Codegen(object):
+    """Translate expression tree into source of single lambda,
+    all constants and functions are bound to names c0, c1, ...
+    """
+
+    def __init__(self):
+        self.args = []
+        self.consts = []
+
+    def arg(self):
+        name = "x%d" % (len(self.args) + 1)
+        self.args.append(name)
+        return name
+
+    def bind(self, value):
+        self.consts.append(value)
+        return "c%d" % (len(self.consts) - 1)
+
+    def emit(self, node):
+        kind = node[0]
+        if kind == "arg":
+            return self.arg()
+        if kind == "const":
+            return self.bind(node[1])
+        if kind == "binop":
+            f, left, right = node[1:4]
+            left, right = self.emit(left), self.emit(right)
+            if isinstance(f, _Flipped):
+                f, left, right = f.__flipback__, right, left
+            syntax = self.syntax(_binary_syntax, f)
+            if syntax is not None:
+                return "(%s %s %s)" % (left, syntax, right)
+            return "%s(%s, %s)" % (self.bind(f), left, right)
+        if kind == "unary":
+            operand = self.emit(node[2])
+            syntax = self.syntax(_unary_syntax, node[1])
+            if syntax is not None:
+                return "(%s%s)" % (syntax, operand)
+            return "%s(%s)" % (self.bind(node[1]), operand)
+        if kind == "getattr":
+            operand, name = self.emit(node[1]), node[2]
+            if _is_identifier(name):
+                return "%s.%s" % (operand, name)
+            return "getattr(%s, %s)" % (operand, self.bind(name))
+        if kind == "getitem":
+            operand = self.emit(node[1])
+            return "%s[%s]" % (operand, self.emit(node[2]))
+        # method call: ("call", operand, name, args, kwargs)
+        operand, name, args, kwargs = self.emit(node[1]), node[2], node[3], node[4]
+        if not (_is_identifier(name) and all(_is_identifier(k) for k in kwargs)):
+            f = operator.methodcaller(name, *args, **kwargs)
+            return "%s(%s)" % (self.bind(f), operand)
+        params = [self.bind(a) for a in args]
+        params.extend("%s=%s" % (k, self.bind(v)) for k, v in sorted(kwargs.items()))
+        return "%s.%s(%s)" % (operand, name, ", ".join(params))
+
+    @staticmethod
+    def syntax(table, f):
+        try:
+            return table.get(f)
+        except TypeError: # unhashable function
+            return None
+
+    def source(self, node):
+        body = self.emit(node)
+        return ("def factory(%s):\n    return lambda %s: %s" %
+                (", ".join("c%d" % i for i in range(len(self.consts))),
+                 ", ".join(self.args), body))
+
+# generated factories by source, so expressions of the same
+# shape (i.e. _ + 1 and _ + 2) share single compiled code object
+# (dropped when it grows over the same limit as interned expressions)
+_factories = {}
+
+# x < c is the same as c > x, so comparison with constant on the right
+# side could be done with partial application of reflected operator
+_reflected = {
+    operator.lt: operator.gt, operator.le: operator.ge,
+    operator.gt: operator.lt, operator.ge: operator.le,
+    operator.eq: operator.eq, operator.ne: operator.ne,
+}
+
+def _attrs_chain(node):
+    names = []
+    while node[0] == "getattr" and "." not in node[2]:
+        names.append(node[2])
+        node = node[1]
+    return ".".join(reversed(names)) if node is ARG and names else None
+
+def _specialize(node):
+    """Return C-implemented callable (from operator and functools)
+    for simple one argument expressions, i.e. attrgetter("a.b") for
+    _.a.b, itemgetter(k) for _[k], partial(operator.gt, 10) for _ < 10.
+    Returns None for other expressions.
+    """
+    kind = node[0]
+    if kind == "getattr":
+        names = _attrs_chain(node)
+        return None if names is None else operator.attrgetter(names)
+    if kind == "getitem" and node[1] is ARG and node[2][0] == "const":
+        return operator.itemgetter(node[2][1])
+    if kind == "call" and node[1] is ARG:
+        return operator.methodcaller(node[2], *node[3], **node[4])
+    if kind == "binop" and node[2] is ARG and node[3][0] == "const":
+        f, const = node[1], node[3][1]
+        if isinstance(f, _Flipped):
+            return partial(f.__flipback__, const)
+        reflected = _Codegen.syntax(_reflected, f)
+        if reflected is not None:
+            return partial(reflected, const)
+    return None
+
+def _compile(node):
+    specialized = _specialize(node)
+    if specialized is not None:
+        return specialized
+
+    gen = _Codegen()
+    source = gen.source(node)
+    factory = _factories.get(source)
+    if factory is None:
+        namespace = {}
+        exec(source, namespace)
+        if len(_factories) >= _INTERNED_LIMIT:
+            _factories.clear()
+        factory = _factories[source] = namespace["factory"]
+    return factory(*gen.consts)
+
+def _vectorizable(node):
+    """Check if expression consists only of operators that
+    work elementwise for NumPy arrays (with scalar constants)
+    """
+    kind = node[0]
+    if kind == "arg":
+        return True
+    if kind == "const":
+        return isinstance(node[1], numbers.Number)
+    if kind == "binop":
+        f = node[1].__flipback__ if isinstance(node[1], _Flipped) else node[1]
+        return (_Codegen.syntax(_binary_syntax, f) is not None and
+                _vectorizable(node[2]) and _vectorizable(node[3]))
+    if kind == "unary":
+        return (_Codegen.syntax(_unary_syntax, node[1]) is not None and
+                _vectorizable(node[2]))
+    return False
+
+_numpy = []
+
+def _import_numpy():
+    # NumPy is optional and imported only on first vectorized call
+    if not _numpy:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy.append(numpy)
+    return _numpy[0]
+
+def _render(node, args):
+    """Build readable representation of expression tree,
+    names for arguments are taken from given iterator
+    """
+    kind = node[0]
+    if kind == "arg":
+        return next(args)
+    if kind == "const":
+        return repr(node[1])
+    if kind == "binop":
+        left = _render(node[2], args)
+        return node[4] % {"self": left, "other": _render(node[3], args)}
+    if kind == "unary":
+        return node[3] % {"self": _render(node[2], args)}
+    if kind == "getattr":
+        return "getattr(%s, %r)" % (_render(node[1], args), node[2])
+    if kind == "getitem":
+        operand = _render(node[1], args)
+        return "%s[%s]" % (operand, _render(node[2], args))
+    # method call is rendered as its operand
+    return _render(node[1], args)
+
+def _template(format):
+    return "(%s)" % (format.replace("%%", "%").replace("%", "%%")
+                           .replace("self", "%(self)s").replace("other", "%(other)s"))
+
+# Structurally identical expressions are interned: (_ + 1) built twice
+# gives the same object, so compiled function is shared too. Children
+# of interned expression are interned as well, so they're referred by id
+# (each key refers only to nodes that are kept alive by its value).
+# Cache is simply dropped when it grows over the limit.
+_interned = {}
+_INTERNED_LIMIT = 4096
+
+_internable = set([type(None), bool, int, float, str, bytes])
+if version_info[0] == 2:
+    _internable.update([long, unicode])
+
+def _const_key(value):
+    if type(value) not in _internable:
+        return None
+    # 0.0 and -0.0 are equal but give different results
+    return type(value), repr(value) if type(value) is float else value
+
+def _expression(cls, key, node, arity):
+    if key is None:
+        return cls(node, arity)
+    key = (cls, ) + key
+    expr = _interned.get(key)
+    if expr is None:
+        if len(_interned) >= _INTERNED_LIMIT:
+            _interned.clear()
+        expr = _interned.setdefault(key, cls(node, arity))
+    return expr
 
 def fmap(f, format):
+    template = _template(format)
     def applyier(self, other):
-        fmt = "(%s)" % format.replace("self", self._format)
-
         if isinstance(other, self.__class__):
-            return self.__class__((f, self, other),
-                                  fmt.replace("other", other._format),
-                                  dict(list(self._format_args.items()) + list(other._format_args.items())),
-                                  self._arity + other._arity)
-        else:
-            call = F(flip(f), other) << F(self)
-            name = _random_name()
-            return self.__class__(call,
-                                  fmt.replace("other", "%%(%s)r" % name),
-                                  dict(list(self._format_args.items()) + [(name, other)]),
-                                  self._arity)
+            return _expression(self.__class__,
+                               ("binop", f, id(self._node), id(other._node)),
+                               ("binop", f, self._node, other._node, template),
+                               self._arity + other._arity)
+        const = _const_key(other)
+        return _expression(self.__class__,
+                           const and ("binop", f, id(self._node), const),
+                           ("binop", f, self._node, ("const", other), template),
+                           self._arity)
     return applyier
 
 class ArityError(TypeError):
@@ -40,46 +270,59 @@ class ArityError(TypeError):
         return "{0!r} expected {1} arguments, got {2}".format(*self.args)
 
 def unary_fmap(f, format):
+    template = _template(format)
     def applyier(self):
-        fmt = "(%s)" % format.replace("self", self._format)
-        return self.__class__(F(self) << f, fmt, self._format_args, self._arity)
+        return _expression(self.__class__,
+                           ("unary", f, id(self._node)),
+                           ("unary", f, self._node, template),
+                           self._arity)
     return applyier
 
 class _Callable(object):
 
-    __slots__ = "_callback", "_format", "_format_args", "_arity"
+    __slots__ = "_node", "_arity", "_compiled"
     # Do not use "flipback" approach for underscore callable,
     # see https://github.com/kachayev/fn.py/issues/23
     __flipback__ = None
 
-    def __init__(self, callback=identity, format="_", format_args=None, arity=1):
-        self._callback = callback
-        self._format = format
-        self._format_args = format_args or {}
+    def __init__(self, node=ARG, arity=1):
+        self._node = node
         self._arity = arity
+        self._compiled = None
 
     def call(self, name, *args, **kwargs):
         """Call method from _ object by given name and arguments"""
-        return self.__class__(F(lambda f: apply(f, args, kwargs)) << operator.attrgetter(name) << F(self))
+        consts = [_const_key(arg) for arg in args]
+        consts.extend(_const_key(v) for _, v in sorted(kwargs.items()))
+        key = None
+        if all(consts):
+            key = ("call", id(self._node), name, tuple(consts), tuple(sorted(kwargs)))
+        return _expression(self.__class__, key,
+                           ("call", self._node, name, args, kwargs),
+                           self._arity)
+
+    def __reduce__(self):
+        # Note, that __reduce__ is defined explicitly, otherwise pickle would
+        # get new underscore function from __getattr__ for special methods
+        return self.__class__, (self._node, self._arity)
 
     def __getattr__(self, name):
-        attr_name = _random_name()
-        return self.__class__(F(operator.attrgetter(name)) << F(self),
-                              "getattr(%s, %%(%s)r)" % (self._format, attr_name),
-                              dict(list(self._format_args.items()) + [(attr_name,name)]),
-                              self._arity)
+        return _expression(self.__class__,
+                           ("getattr", id(self._node), name),
+                           ("getattr", self._node, name),
+                           self._arity)
 
     def __getitem__(self, k):
         if isinstance(k, self.__class__):
-            return self.__class__((operator.getitem, self, k),
-                                  "%s[%s]" % (self._format, k._format),
-                                  dict(list(self._format_args.items()) + list(k._format_args.items())),
-                                  self._arity + k._arity)
-        item_name = _random_name()
-        return self.__class__(F(operator.itemgetter(k)) << F(self),
-                              "%s[%%(%s)r]" % (self._format,item_name),
-                              dict(list(self._format_args.items()) + [(item_name,k)]),
-                              self._arity)
+            return _expression(self.__class__,
+                               ("getitem", id(self._node), id(k._node)),
+                               ("getitem", self._node, k._node),
+                               self._arity + k._arity)
+        const = _const_key(k)
+        return _expression(self.__class__,
+                           const and ("getitem", id(self._node), const),
+                           ("getitem", self._node, ("const", k)),
+                           self._arity)
 
     def __str__(self):
         """Build readable representation for function
@@ -87,32 +330,19 @@ class _Callable(object):
         (_ < 7): (x1) => (x1 < 7)
         (_ + _*10): (x1, x2) => (x1 + (x2*10))
         """
-        # args iterator with produce infinite sequence
-        # args -> (x1, x2, x3, ...)
-        args = map("".join, zip(repeat("x"), map(str, count(1))))
-        l, r = [], self._format
-        # replace all "_" signs from left to right side
-        while r.count("_"):
-            n = next(args)
-            r = r.replace("_", n, 1)
-            l.append(n)
-
-        r = r % self._format_args
-        return "({left}) => {right}".format(left=", ".join(l), right=r)
+        args = ["x%d" % i for i in range(1, self._arity + 1)]
+        right = _render(self._node, iter(args))
+        return "({left}) => {right}".format(left=", ".join(args), right=right)
 
     def __repr__(self):
         """Return original function notation to ensure that eval(repr(f)) == f"""
-        return re.sub(r"x\d+", "_", str(self).split("=>", 1)[1].strip())
+        return _render(self._node, repeat("_"))
 
     def __call__(self, *args):
         if len(args) != self._arity:
             raise ArityError(self, self._arity, len(args))
 
-        if not isinstance(self._callback, tuple):
-            return self._callback(*args)
-
-        f, left, right = self._callback
-        return f(left(*args[:left._arity]), right(*args[left._arity:]))
+        return (self._compiled or compile(self))(*args)
 
     __add__ = fmap(operator.add, "self + other")
     __mul__ = fmap(operator.mul, "self * other")
@@ -161,3 +391,47 @@ class _Callable(object):
     __rxor__ = fmap(flip(operator.xor), "other ^ self")
 
 shortcut = _Callable()
+
+# Note, that helpers below are functions (not methods of _Callable),
+# otherwise they would shadow attributes access, i.e. _.compile
+
+def compile(expr):
+    """Return plain Python function generated from the expression,
+    i.e. for (_ + _ * 2) it's the same as lambda x1, x2: (x1 + (x2 * 2)).
+    Function is built once and cached, it doesn't check arity.
+
+    Simple expressions like _.a.b, _["id"], _ < 10 or _.call("strip")
+    are compiled into operator.attrgetter, itemgetter, methodcaller or
+    functools.partial objects, so sorted(items, key=compile(_.name))
+    doesn't execute Python code to compute keys at all.
+    """
+    if expr._compiled is None:
+        expr._compiled = _compile(expr._node)
+    return expr._compiled
+
+def vectorize(expr):
+    """Return function that evaluates expression over whole columns
+    (one per argument): NumPy arrays or any buffers/sequences, i.e.
+    array.array or memoryview, that are converted to arrays without
+    copying. Arithmetic, bitwise and comparison operators are applied
+    to arrays at once (so NumPy semantics for overflows etc. apply),
+    other expressions are evaluated with compiled function element by
+    element. Without NumPy installed result is a list.
+    """
+    scalar, arity = compile(expr), expr._arity
+    vectorizable = _vectorizable(expr._node)
+
+    def vectorized(*columns):
+        if len(columns) != arity:
+            raise ArityError(expr, arity, len(columns))
+        numpy = _import_numpy()
+        if numpy is None:
+            return list(map(scalar, *columns))
+        if vectorizable:
+            return scalar(*[numpy.asarray(c) for c in columns])
+        return numpy.array(list(map(scalar, *columns)))
+    return vectorized
+
+def over(expr, *columns):
+    """Evaluate expression over given columns, see vectorize"""
+    return vectorize(expr)(*columns)
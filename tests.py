@@ -9,6 +9,7 @@ import itertools
 
 from fn import op, _, F, Stream, iters, underscore, monad, recur
 from fn.uniform import reduce
+from fn.stream import SharedStream
 from fn.immutable import SkewHeap, PairingHeap, LinkedList, Stack, Queue, Vector, Deque
 
 class InstanceChecker(object):
@@ -356,6 +357,119 @@ class UnderscoreTestCase(unittest.TestCase):
             repr(reduce(_ & _, (_,) * 12)),
         )
 
+    def test_compile(self):
+        f = underscore.compile(_ * 2 + 1)
+        self.assertEqual(11, f(5))
+        self.assertEqual([1, 3, 5], list(map(f, [0, 1, 2])))
+        # compiled function is cached
+        expr = _ + _
+        self.assertTrue(underscore.compile(expr) is underscore.compile(expr))
+        self.assertEqual(7, underscore.compile(expr)(3, 4))
+        # attributes with such names are still available
+        class Obj(object):
+            compile = "attr"
+        self.assertEqual("attr", _.compile(Obj()))
+
+    def test_compile_operations(self):
+        class Obj(object):
+            def __init__(self):
+                self.value = 10
+                setattr(self, "not an identifier", 20)
+
+        self.assertEqual(-3, underscore.compile(3 - _ * 2 - 2 * _)(1, 2))
+        self.assertEqual(3, underscore.compile(_ // 2)(7))
+        self.assertEqual((2, 1), underscore.compile(divmod(_, 3))(7))
+        self.assertEqual(-11, underscore.compile(~_)(10))
+        self.assertTrue(underscore.compile(_.value < _)(Obj(), 11))
+        self.assertEqual(20, underscore.compile(getattr(_, "not an identifier"))(Obj()))
+        self.assertEqual([2, 3], underscore.compile(_[1:3])([1, 2, 3, 4]))
+        self.assertEqual(3, underscore.compile(_[_])([1, 2, 3, 4], 2))
+        self.assertEqual(["a", "b"], underscore.compile(_.call("split", "-"))("a-b"))
+        self.assertEqual("1-2", underscore.compile(_.call("format", 1, b=2))("{0}-{b}"))
+        self.assertEqual("A_B", (_ + "_" + _).call("upper")("a", "b"))
+
+    def test_compile_specialized(self):
+        class Obj(object):
+            def __init__(self, value):
+                self.value = value
+                self.child = self
+
+        self.assertTrue(isinstance(underscore.compile(_.value), operator.attrgetter))
+        self.assertEqual(5, underscore.compile(_.child.value)(Obj(5)))
+        self.assertTrue(isinstance(underscore.compile(_["id"]), operator.itemgetter))
+        self.assertEqual(1, underscore.compile(_["id"])({"id": 1}))
+        self.assertTrue(isinstance(underscore.compile(_.call("strip")), operator.methodcaller))
+        self.assertEqual("a", underscore.compile(_.call("strip"))(" a "))
+        for expr, args in (((_ < 10), (5, 10, 15)), ((_ >= 10), (5, 10, 15)),
+                           ((_ == 10), (5, 10)), ((10 - _), (3, )), (("a" + _), ("b", ))):
+            self.assertFalse(type(underscore.compile(expr)).__name__ == "function")
+            for arg in args:
+                self.assertEqual(underscore.compile(expr)(arg), expr(arg))
+        self.assertEqual([3, 1], [o.value for o in sorted([Obj(3), Obj(1)], key=underscore.compile(_.value), reverse=True)])
+        # not commutative for strings, so can't use partial application
+        self.assertEqual("ab", underscore.compile(_ + "b")("a"))
+
+    def test_interning(self):
+        self.assertTrue((_ + 1) is (_ + 1))
+        self.assertTrue(_.name[0] is _.name[0])
+        self.assertTrue(underscore.compile(_ * 2 + 1) is underscore.compile(_ * 2 + 1))
+        # equal, but different constants
+        self.assertFalse((_ + 1) is (_ + True))
+        self.assertFalse((_ * 0.0) is (_ * -0.0))
+        self.assertFalse((_ + _) is (_ + 1))
+        # unhashable constants are not interned
+        self.assertFalse(_[[1]] is _[[1]])
+        self.assertEqual(2, (_ + 1)(1))
+
+    def test_compiled_factories_are_bounded(self):
+        for i in range(underscore._INTERNED_LIMIT + 10):
+            underscore.compile(getattr(_ + 1, "attr%d" % i))
+        self.assertTrue(len(underscore._factories) <= underscore._INTERNED_LIMIT)
+        self.assertEqual(2, (_ + 1).real(1))
+
+    def test_constants_string_converting(self):
+        self.assertEqual("(x1) => (x1 + 'other')", str(_ + "other"))
+        self.assertEqual("(x1, x2) => ((x1 + 'x1') + x2)", str(_ + "x1" + _))
+        self.assertEqual("((_ + 'x1') + _)", repr(_ + "x1" + _))
+        self.assertEqual("(x1) => (x1 % '%s')", str(_ % "%s"))
+
+class VectorizedUnderscoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        self.numpy = numpy
+
+    def test_scalar_fallback(self):
+        from array import array
+        expr = underscore.vectorize(_ * 2 + 1)
+        self.assertEqual([1, 3, 5], list(expr(array("l", [0, 1, 2]))))
+        self.assertEqual([3, 5], list(underscore.over(_ + _, [1, 2], [2, 3])))
+        self.assertEqual(["A", "B"], list(underscore.over(_.call("upper"), ["a", "b"])))
+        self.assertRaises(underscore.ArityError, underscore.over, _ + _, [1, 2])
+
+    def test_attributes_access(self):
+        class Obj(object):
+            over, vectorize = "over", "vectorize"
+        self.assertEqual("over", _.over(Obj()))
+        self.assertEqual("vectorize", _.vectorize(Obj()))
+
+    def test_numpy_arrays(self):
+        if self.numpy is None:
+            self.skipTest("numpy is not installed")
+        from array import array
+        column = self.numpy.arange(5)
+        result = underscore.over(_ * 2 + 1, column)
+        self.assertTrue(isinstance(result, self.numpy.ndarray))
+        self.assertEqual([1, 3, 5, 7, 9], result.tolist())
+        self.assertEqual([True, False], underscore.over(_ < 5, array("d", [1.0, 7.0])).tolist())
+        self.assertEqual([9, 8], underscore.over(10 - _, memoryview(array("i", [1, 2]))).tolist())
+        self.assertEqual([0, 2, 4, 6, 8], underscore.over(_ + _, column, column).tolist())
+        # non-elementwise operations fall back to scalar evaluation
+        self.assertEqual([0, 1, 2, 3, 4], underscore.over(_.real, column).tolist())
+
 class CompositionTestCase(unittest.TestCase):
 
     def test_composition(self):
@@ -385,6 +499,398 @@ class CompositionTestCase(unittest.TestCase):
         func = F() >> (iters.filter, _ < 6) >> sum
         self.assertEqual(15, func(iters.range(10)))
 
+    def test_identity(self):
+        self.assertEqual(10, F()(10))
+        self.assertEqual(10, (F() >> F() << F())(10))
+        self.assertEqual(op.identity, F().f)
+
+    def test_flat_stages(self):
+        def f(x): return x * 2
+        def g(x): return x + 10
+
+        func = F(f) << g << (F() >> f >> (operator.add, 1))
+        self.assertEqual(4, len(func._stages))
+        self.assertEqual(42, func(5))
+        self.assertEqual(f, F(f).f)
+
+    def test_long_composition(self):
+        func = F()
+        for _i in range(sys.getrecursionlimit() * 10):
+            func = func >> (operator.add, 1)
+        self.assertEqual(sys.getrecursionlimit() * 10, func(0))
+
+    def test_compile(self):
+        def f(x, y=0): return x * 2 + y
+        def g(x): return x + 10
+
+        func = (F(f) >> g >> (operator.mul, 3)).compile()
+        self.assertEqual(60, func(5))
+        self.assertEqual(63, func(5, y=1))
+        self.assertEqual(7, F().compile()(7))
+
+        func = F()
+        for _i in range(5000):
+            func = func >> (operator.add, 1)
+        self.assertEqual(5000, func.compile()(0))
+
+class ProfiledCompositionTestCase(unittest.TestCase):
+
+    def test_profile(self):
+        pipeline = F() >> (map, _ * 2) >> (filter, _ > 5) >> list >> sum
+        profiled = pipeline.profile()
+        for _i in range(3):
+            self.assertEqual(84, profiled(range(10)))
+        # original composition is not instrumented
+        self.assertEqual([], pipeline.stats())
+
+        stats = profiled.stats()
+        self.assertEqual(["0: map(...)", "1: filter(...)", "2: list", "3: sum"], [s.name for s in stats])
+        self.assertEqual([3, 3, 3, 3], [s.calls for s in stats])
+        # iterators (map and filter results on Python 3) are not counted by default
+        self.assertEqual([21, 0], [s.items for s in stats[2:]])
+        for s in stats:
+            self.assertTrue(0 <= s.max <= s.total)
+        self.assertEqual(5, len(profiled.report().splitlines()))
+        # profiling profiled composition starts from scratch
+        self.assertEqual([0] * 4, [s.calls for s in profiled.profile().stats()])
+
+    def test_profile_count_items(self):
+        pipeline = (F() >> (map, _ * 2) >> (filter, _ > 5) >> list >> sum).profile(count_items=True)
+        self.assertEqual(84, pipeline(range(10)))
+        self.assertEqual([10, 7, 7, 0], [s.items for s in pipeline.stats()])
+
+    def test_profile_keeps_results(self):
+        from io import StringIO
+
+        readline = (F() >> StringIO >> (lambda f: f.readline())).profile()
+        self.assertEqual(u"a\n", readline(u"a\nb"))
+        s = Stream(window=10) << iters.range(100)
+        self.assertTrue((F() >> (lambda x: s)).profile()(None) is s)
+        self.assertEqual(0, len(s._cursors))
+
+    def test_profile_hook(self):
+        calls = []
+        profiled = (F(operator.add, 1) >> str).profile(lambda *args: calls.append(args))
+        self.assertEqual("2", profiled(1))
+        self.assertEqual(["0: add(...)", "1: str"], [name for name, _e, _r in calls])
+        self.assertEqual([2, "2"], [result for _n, _e, result in calls])
+
+class CurriedTestCase(unittest.TestCase):
+
+    def test_curried(self):
+        from fn.func import curried
+
+        @curried
+        def sum5(a, b, c, d, e):
+            return a + b + c + d + e
+
+        self.assertEqual(15, sum5(1)(2)(3)(4)(5))
+        self.assertEqual(15, sum5(1, 2, 3)(4, 5))
+        self.assertEqual(15, sum5(1, e=5)(2)(3, 4))
+        self.assertEqual("sum5", sum5.__name__)
+        # partial applications are independent
+        add3 = sum5(1, 1, 1)
+        self.assertEqual(5, add3(1, 1))
+        self.assertEqual(7, add3(2, 2))
+
+    def test_curried_defaults(self):
+        from fn.func import curried
+
+        @curried
+        def power(a, b, p=2, *rest):
+            return (a + b) ** p + sum(rest)
+
+        # arguments with default values are waited for as well
+        self.assertTrue(callable(power(1)(2)))
+        self.assertEqual(9, power(1)(2)(2))
+        self.assertEqual(27, power(1)(2, 3))
+        self.assertEqual(30, power(1)(2, 3, 1, 2))
+        self.assertEqual(8, power(b=1)(a=1, p=3))
+        self.assertEqual(9, power(1, 2, p=2))
+
+    def test_curried_keyword_only(self):
+        if sys.version_info[0] == 2:
+            self.skipTest("keyword-only arguments require Python 3")
+        from fn.func import curried
+
+        namespace = {}
+        exec("def scale(a, *, factor, shift=0): return a * factor + shift", namespace)
+        scale = curried(namespace["scale"])
+        self.assertEqual(20, scale(2)(factor=10))
+        self.assertEqual(21, scale(factor=10, shift=1)(2))
+
+class MemoizeTestCase(unittest.TestCase):
+
+    def test_memoize(self):
+        from fn.func import memoize
+
+        calls = []
+        @memoize
+        def fib(n):
+            calls.append(n)
+            return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+        self.assertEqual(832040, fib(30))
+        self.assertEqual(list(range(30, -1, -1)), calls)
+        self.assertEqual((28, 31, 0, 31), tuple(fib.stats()))
+        self.assertEqual("fib", fib.__name__)
+        fib.clear()
+        self.assertEqual(0, fib.stats().size)
+
+    def test_memoize_kwargs_and_errors(self):
+        from fn.func import memoize
+
+        calls = []
+        @memoize
+        def div(a, b=1):
+            calls.append((a, b))
+            return a // b
+
+        self.assertEqual(5, div(10, b=2))
+        self.assertEqual(5, div(10, b=2))
+        self.assertEqual(10, div(10))
+        self.assertRaises(ZeroDivisionError, div, 10, b=0)
+        self.assertRaises(ZeroDivisionError, div, 10, b=0)
+        self.assertEqual([(10, 2), (10, 1), (10, 0), (10, 0)], calls)
+
+    def test_lru(self):
+        from fn.func import memoize, LRU
+
+        f = memoize(LRU(2))(F(abs) >> str)
+        self.assertEqual(["1", "2", "1", "3"], [f(-1), f(-2), f(-1), f(-3)])
+        # 2 is evicted as least recently used one
+        self.assertEqual((1, 3, 1, 2), tuple(f.stats()))
+        f(-1)
+        self.assertEqual(2, f.stats().hits)
+        f(-2)
+        self.assertEqual(4, f.stats().misses)
+
+    def test_lfu(self):
+        from fn.func import memoize, LFU
+
+        calls = []
+        @memoize(LFU(2))
+        def square(x):
+            calls.append(x)
+            return x * x
+
+        for x in (1, 1, 1, 2, 3, 2, 1):
+            square(x)
+        self.assertEqual([1, 2, 3, 2], calls)
+        self.assertEqual(2, square.stats().evictions)
+
+    def test_zero_size(self):
+        from fn.func import memoize, LRU, LFU
+
+        for policy in (LRU(0), LFU(0)):
+            f = memoize(policy)(lambda x: x * 2)
+            self.assertEqual([2, 2], [f(1), f(1)])
+            self.assertEqual((0, 2, 2, 0), tuple(f.stats()))
+
+    def test_ttl(self):
+        from fn.func import memoize, TTL
+
+        now = [0]
+        calls = []
+        @memoize(policy=TTL(10, maxsize=2, clock=lambda: now[0]))
+        def f(x):
+            calls.append(x)
+            return x
+
+        f(1)
+        f(1)
+        now[0] = 5
+        f(2)
+        f(3) # 1 is evicted as the oldest one
+        f(2)
+        now[0] = 12
+        f(2)
+        f(3)
+        now[0] = 16
+        f(2) # expired
+        self.assertEqual([1, 2, 3, 2], calls)
+        self.assertEqual((4, 4, 3, 1), tuple(f.stats()))
+
+    def test_weighted(self):
+        from fn.func import memoize, Weighted
+
+        f = memoize(Weighted(10, weight=len))(lambda n: "x" * n)
+        f(4)
+        f(5)
+        self.assertEqual((0, 2, 0, 2), tuple(f.stats()))
+        f(3)
+        self.assertEqual((0, 3, 1, 2), tuple(f.stats()))
+        # too heavy values are not stored at all
+        f(20)
+        self.assertEqual(0, f.stats().size)
+
+    def test_single_flight(self):
+        import threading
+        import time
+        from fn.func import memoize
+
+        calls = []
+        @memoize
+        def slow(x):
+            calls.append(x)
+            time.sleep(0.1)
+            return x * 2
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(slow(21))) for _ in range(5)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        self.assertEqual([42] * 5, results)
+        self.assertEqual([21], calls)
+
+    def test_immutable_keys(self):
+        from fn.func import memoize, curried
+        from fn.immutable import Vector, LinkedList
+
+        calls = []
+        @memoize
+        def total(items):
+            calls.append(items)
+            return sum(items)
+
+        self.assertEqual(3, total(Vector().cons(1).cons(2)))
+        self.assertEqual(3, total(Vector().cons(1).cons(2)))
+        self.assertEqual(3, total(LinkedList().cons(1).cons(2)))
+        self.assertEqual(2, len(calls))
+
+        memoized = memoize(lambda a, b: a + b)
+        add = curried(memoized)
+        self.assertEqual(3, add(1)(2))
+        self.assertEqual(3, add(1, 2))
+        self.assertEqual((1, 1), tuple(memoized.stats())[:2])
+
+    def test_disk(self):
+        import shutil
+        import tempfile
+        from fn.func import memoize, LRU
+
+        directory = tempfile.mkdtemp()
+        try:
+            calls = []
+            def square(x):
+                calls.append(x)
+                return x * x
+
+            first = memoize(LRU(10), disk=directory, name="square")(square)
+            self.assertEqual([1, 4], [first(1), first(2)])
+            # new process would start with empty memory
+            second = memoize(LRU(10), disk=directory, name="square")(square)
+            self.assertEqual([1, 4, 9], [second(1), second(2), second(3)])
+            self.assertEqual([1, 2, 3], calls)
+            self.assertEqual((2, 1, 0, 3), tuple(second.stats()))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_disk_namespaces(self):
+        import shutil
+        import tempfile
+        from functools import partial
+        from fn.func import memoize
+
+        directory = tempfile.mkdtemp()
+        try:
+            def f(x): return x + 1
+            inc = memoize(f, disk=directory)
+            def f(x): return x * 2
+            double = memoize(f, disk=directory)
+            self.assertEqual([11, 20], [inc(10), double(10)])
+
+            # no stable identity without explicit name
+            self.assertRaises(TypeError, memoize, lambda x: x, disk=directory)
+            self.assertRaises(TypeError, memoize, F(operator.add, 1), disk=directory)
+            self.assertRaises(TypeError, memoize, partial(operator.add, 1), disk=directory)
+            add = memoize(F(operator.add, 1), disk=directory, name="add_v1")
+            self.assertEqual(11, add(10))
+        finally:
+            shutil.rmtree(directory)
+
+class ParallelStagesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            from fn import parallel
+        except ImportError:
+            self.skipTest("concurrent.futures is not available")
+        self.parallel = parallel
+
+    def test_pmap_pfilter(self):
+        pmap, pfilter = self.parallel.pmap, self.parallel.pfilter
+        func = F() >> pmap(_ * 2, chunksize=3) >> pfilter(_ > 10) >> list
+        self.assertEqual([12, 14, 16, 18], func(range(10)))
+        self.assertEqual([], func([]))
+
+    def test_tuple_syntax(self):
+        func = F() >> (self.parallel.pmap, abs) >> (self.parallel.pfilter, _ > 1) >> list
+        self.assertEqual([2, 3], func([-1, 2, -3]))
+
+    def test_unordered(self):
+        pmap = self.parallel.pmap
+        func = F() >> pmap(_ + 1, ordered=False, chunksize=7) >> sorted
+        self.assertEqual(list(range(1, 101)), func(range(100)))
+
+    def test_lazy_and_bounded(self):
+        pulled = []
+        def source():
+            for i in range(1000):
+                pulled.append(i)
+                yield i
+
+        results = self.parallel.pmap(_ + 1, source(), chunksize=10, inflight=2)
+        self.assertEqual([], pulled)
+        self.assertEqual([1, 2], list(iters.take(2, results)))
+        self.assertTrue(len(pulled) <= 30)
+        results.close()
+
+    def test_process_pool_and_errors(self):
+        from concurrent.futures import ProcessPoolExecutor
+        pmap = self.parallel.pmap
+        self.assertEqual([1, 2, 3], list(pmap(abs, [-1, 2, -3], executor=ProcessPoolExecutor)))
+
+        with ProcessPoolExecutor(2) as executor:
+            results = pmap(operator.neg, ["a"], executor=executor)
+            self.assertRaises(TypeError, list, results)
+
+class PicklingTestCase(unittest.TestCase):
+
+    def _roundtrip(self, f):
+        import pickle
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            yield pickle.loads(pickle.dumps(f, protocol))
+
+    def test_pickle_composition(self):
+        func = F(operator.add, 10) >> abs >> (operator.mul, 2) << F(op.flip(operator.sub), 1)
+        for restored in self._roundtrip(func):
+            self.assertEqual(func(-20), restored(-20))
+        for restored in self._roundtrip(F()):
+            self.assertEqual(5, restored(5))
+
+    def test_pickle_underscore(self):
+        exprs = [_, _ + 1, (_ + 1) * 2 < _.real, 10 - _, -_, _ % _,
+                 _[0], _[_], _.call("upper"), _.call("split", ","), F() << (_ ** 2) << _ + 1]
+        args = [(5, ), (5, ), (5, 3), (5, ), (5, ), (10, 3),
+                ("abc", ), ("abc", 1), ("abc", ), ("a,b", ), (3, )]
+        for expr, arg in zip(exprs, args):
+            for restored in self._roundtrip(expr):
+                self.assertEqual(expr(*arg), restored(*arg))
+                if isinstance(expr, underscore._Callable):
+                    self.assertEqual(str(expr), str(restored))
+
+    def test_process_pool(self):
+        try:
+            from concurrent.futures import ProcessPoolExecutor
+        except ImportError:
+            self.skipTest("concurrent.futures is not available")
+
+        func = F() >> (_ * 2) >> (operator.add, 1)
+        with ProcessPoolExecutor(2) as executor:
+            self.assertEqual([1, 3, 5], list(executor.map(func, range(3))))
+            self.assertEqual([True, False], list(executor.map(_.call("startswith", "a"), ["ab", "ba"])))
+
 class IteratorsTestCase(unittest.TestCase):
 
     def test_take(self):
@@ -691,6 +1197,566 @@ class StreamTestCase(unittest.TestCase):
     def test_origin_param_string(self):
         self.assertEqual(["stream"], list(Stream("stream")))
 
+    def test_negative_index(self):
+        s = Stream() << iters.range(10)
+        self.assertEqual(9, s[-1])
+        self.assertEqual(0, s[-10])
+        self.assertRaises(IndexError, s.__getitem__, -11)
+        self.assertRaises(IndexError, s.__getitem__, 10)
+        self.assertRaises(IndexError, (Stream() << []).__getitem__, -1)
+
+    def test_slicing_with_step(self):
+        s = Stream() << iters.range(20)
+        self.assertEqual([2, 5, 8], list(s[2:10:3]))
+        self.assertEqual(list(range(0, 20, 2)), list(s[::2]))
+        self.assertEqual([18, 19], list(s[18:30]))
+        self.assertEqual([], list(s[30:40]))
+        self.assertRaises(ValueError, s.__getitem__, slice(0, 10, 0))
+
+        s = Stream() << iters.range(20)
+        s_slice = s[10:20:5]
+        self.assertEqual(0, s.cursor())
+        self.assertEqual(10, s_slice[0])
+        self.assertEqual(11, s.cursor())
+
+    def test_slicing_negative(self):
+        s = Stream() << iters.range(10)
+        self.assertEqual([7, 8, 9], list(s[-3:]))
+        self.assertEqual([0, 1], list(s[:-8]))
+        self.assertEqual(list(range(9, -1, -1)), list(s[::-1]))
+        self.assertEqual([9, 7], list(s[-1:-5:-2]))
+
+        # reversed slice with given start doesn't need the whole stream
+        s = Stream() << itertools.count()
+        self.assertEqual([5, 4, 3, 2, 1], list(s[5:0:-1]))
+        self.assertEqual([6, 4, 2, 0], list(s[6::-2]))
+
+    def test_fill_chunk(self):
+        s = Stream() << iters.range(10) << iters.range(10, 20)
+        self.assertEqual(15, s[15])
+        self.assertEqual(16, s.cursor())
+        self.assertEqual(19, s[-1])
+        self.assertEqual(20, s.cursor())
+        self.assertEqual(list(range(20)), list(s))
+
+    def test_many_appended_sources(self):
+        s = Stream()
+        for i in range(100000):
+            s = s << [i]
+        self.assertEqual(50000, s[50000])
+        self.assertEqual(list(range(100000)), list(s))
+
+        s = Stream(1) << [] << iter([]) << (2, 3) << []
+        self.assertEqual([1, 2, 3], list(s))
+        # sources appended after exhaustion should be consumed as well
+        s << [4]
+        self.assertEqual([1, 2, 3, 4], list(s))
+
+    def test_window_releases_passed_elements(self):
+        s = Stream(window=10) << iters.range(100000)
+        self.assertEqual(sum(range(100000)), sum(s))
+        self.assertTrue(len(s._collection) < 5000)
+        self.assertEqual(99999, s[99999])
+        self.assertEqual(99990, s[99990])
+        self.assertRaises(IndexError, s.__getitem__, 0)
+
+    def test_window_keeps_elements_for_slow_iterator(self):
+        s = Stream(window=0) << iters.range(10000)
+        slow, fast = iter(s), iter(s)
+        self.assertEqual(0, next(slow))
+        self.assertEqual(list(range(10000)), list(fast))
+        self.assertEqual(list(range(1, 10000)), list(slow))
+
+        # once slow iterator is gone elements could be released
+        del slow, fast
+        s = Stream(window=0) << iters.range(10000)
+        self.assertEqual(9999, s[9999])
+        self.assertRaises(IndexError, s.__getitem__, 10)
+
+    def test_window_ignores_iterators_behind_released_elements(self):
+        s = Stream(window=10) << iters.range(100000)
+        fast = iter(s)
+        iters.consume(fast, 5000)
+        # created after first release and never advanced
+        late = iter(s)
+        # derived stream that is not consumed yet
+        derived = s.map(_ * 2)
+        iters.consume(fast, 90000)
+        self.assertTrue(len(s._collection) < 5000)
+        self.assertRaises(IndexError, next, late)
+        self.assertRaises(IndexError, next, iter(derived))
+
+    def test_window_infinite_fib_stream(self):
+        from operator import add
+
+        f = Stream(window=2)
+        fib = f << [0, 1] << iters.map(add, f, iters.drop(1, f))
+        self.assertEqual(6765, iters.nth(fib, 20))
+        self.assertEqual(10946, fib[21])
+        iters.consume(fib, 10000)
+        self.assertTrue(len(fib._collection) < 5000)
+        self.assertRaises(IndexError, fib.__getitem__, 0)
+
+    def test_window_invalid_arguments(self):
+        self.assertRaises(ValueError, Stream, window=-1)
+        self.assertRaises(TypeError, Stream, size=10)
+
+class StreamCombinatorsTestCase(unittest.TestCase):
+
+    def test_map_filter(self):
+        s = Stream() << iters.range(10)
+        self.assertEqual([0, 2, 4], list(s.map(_ * 2)[:3]))
+        self.assertEqual([1, 3, 5, 7, 9], list(s.filter(_ % 2)))
+
+    def test_zip(self):
+        s = Stream() << iters.range(5)
+        self.assertEqual([(0, 0, "a"), (1, 1, "b")], list(s.zip(s, "ab")))
+
+    def test_take_while(self):
+        s = Stream() << itertools.count()
+        self.assertEqual([0, 1, 2, 3, 4], list(s.take_while(_ < 5)))
+        self.assertEqual(6, s.cursor())
+
+    def test_flat_map(self):
+        s = Stream() << [1, 2, 3]
+        self.assertEqual([1, 2, 2, 3, 3, 3], list(s.flat_map(lambda n: [n] * n)))
+
+    def test_scan(self):
+        s = Stream() << [1, 2, 3, 4]
+        self.assertEqual([1, 3, 6, 10], list(s.scan(operator.add)))
+        self.assertEqual([10, 11, 13, 16, 20], list(s.scan(operator.add, 10)))
+        self.assertEqual([], list(Stream().scan(operator.add)))
+        self.assertEqual([0], list(Stream().scan(operator.add, 0)))
+
+    def test_lazy_and_memoized(self):
+        calls = []
+        def square(n):
+            calls.append(n)
+            return n * n
+
+        s = Stream() << itertools.count()
+        squares = s.map(square)
+        self.assertEqual(0, s.cursor())
+        self.assertEqual(100, squares[10])
+        self.assertEqual(11, s.cursor())
+        self.assertEqual(list(range(11)), calls)
+        # results of transformation are shared between all consumers
+        self.assertEqual([0, 1, 4], list(squares[:3]))
+        self.assertEqual(list(range(11)), calls)
+
+    def test_derived_from_infinite_stream(self):
+        from operator import add
+        f = Stream()
+        fib = f << [0, 1] << iters.map(add, f, iters.drop(1, f))
+        evens = fib.filter(lambda n: n % 2 == 0)
+        self.assertEqual([0, 2, 8, 34, 144], list(iters.take(5, evens)))
+
+class StreamCheckpointTestCase(unittest.TestCase):
+
+    def _source(self, start, pulled):
+        for i in range(start, 100):
+            pulled.append(i)
+            yield i
+
+    def test_checkpoint_restore(self):
+        import pickle
+        pulled = []
+        s = Stream() << self._source(0, pulled)
+        it = iter(s)
+        self.assertEqual([0, 1, 2], list(iters.take(3, it)))
+        self.assertEqual(20, s[20])
+
+        state = pickle.loads(pickle.dumps(s.checkpoint(source=s.cursor, cursors=[it])))
+        self.assertEqual(21, state["source"])
+        self.assertEqual([3], state["cursors"])
+
+        del pulled[:]
+        restored = Stream.restore(state, resume=lambda start: self._source(start, pulled))
+        self.assertEqual(21, restored.cursor())
+        self.assertEqual(list(range(100)), list(restored))
+        # evaluated prefix is not recomputed after restore
+        self.assertEqual(list(range(21, 100)), pulled)
+        self.assertEqual(list(range(3, 100)), list(restored.iter_from(state["cursors"][0])))
+
+    def test_checkpoint_window(self):
+        s = Stream(window=10) << iters.range(5000)
+        it = iter(s)
+        iters.consume(it, 3000)
+        state = s.checkpoint(source=s.cursor, cursors=[it])
+
+        restored = Stream.restore(state, resume=lambda start: iters.range(start, 5000), window=10)
+        self.assertEqual(list(range(3000, 5000)), list(restored.iter_from(state["cursors"][0])))
+        self.assertRaises(IndexError, restored.__getitem__, 0)
+
+    def test_checkpoint_spill(self):
+        import pickle
+        import shutil
+        s = Stream(spill=10) << iters.range(3000)
+        self.assertEqual(2999, s[2999])
+        state = pickle.loads(pickle.dumps(s.checkpoint(source=s.cursor)))
+        # spilled elements are kept on disk
+        self.assertEqual(s._offset, state["offset"])
+        self.assertTrue(len(state["elements"]) < 3000)
+        try:
+            self.assertRaises(ValueError, Stream.restore, state)
+            restored = Stream.restore(state, resume=lambda start: iters.range(start, 5000), spill=10)
+            del s
+            self.assertEqual(list(range(5000)), list(restored))
+            self.assertEqual(1234, restored[1234])
+            self.assertTrue(len(restored._collection) < 5000)
+        finally:
+            shutil.rmtree(state["spilled"]["dir"])
+
+    def test_checkpoint_errors(self):
+        s = Stream(prefetch=2) << [1, 2]
+        self.assertRaises(ValueError, s.checkpoint)
+        s = Stream() << [1, 2]
+        self.assertRaises(ValueError, s.checkpoint, cursors=[iter(Stream())])
+
+class PrefetchStreamTestCase(unittest.TestCase):
+
+    def test_prefetch_elements(self):
+        s = Stream(prefetch=10) << iters.range(1000) << [1000, 1001]
+        self.assertEqual(list(range(1002)), list(s))
+        self.assertEqual(500, s[500])
+        self.assertEqual(1001, s[-1])
+
+    def test_prefetch_is_bounded(self):
+        import time
+        pulled = []
+        def source():
+            for i in range(100):
+                pulled.append(i)
+                yield i
+
+        s = Stream(prefetch=5) << source
+        # nothing is evaluated before first request
+        time.sleep(0.05)
+        self.assertEqual([], pulled)
+
+        self.assertEqual(0, s[0])
+        time.sleep(0.1)
+        # up to 5 elements in queue and one is waiting to be put
+        self.assertTrue(len(pulled) <= 7)
+        self.assertEqual(list(range(100)), list(s))
+
+    def test_prefetch_overlaps_consuming(self):
+        import time
+        def slow():
+            for i in range(5):
+                time.sleep(0.05)
+                yield i
+
+        s = Stream(prefetch=5) << slow
+        self.assertEqual(0, s[0])
+        # all other elements are evaluated while consumer is busy
+        time.sleep(0.4)
+        started = time.time()
+        self.assertEqual([0, 1, 2, 3, 4], list(s))
+        self.assertTrue(time.time() - started < 0.04)
+
+    def test_prefetch_exception_at_index(self):
+        def broken():
+            yield 1
+            yield 2
+            raise ValueError("broken source")
+
+        s = Stream(prefetch=10) << broken << [3]
+        self.assertEqual(2, s[1])
+        self.assertRaises(ValueError, s.__getitem__, 2)
+        # broken source is done, stream continues with the next one
+        self.assertEqual([1, 2, 3], list(s))
+
+    def test_prefetch_with_executor(self):
+        try:
+            from concurrent.futures import ThreadPoolExecutor
+        except ImportError:
+            self.skipTest("concurrent.futures is not available")
+
+        executor = ThreadPoolExecutor(2)
+        s = Stream(prefetch=3, executor=executor) << iters.range(100) << iters.range(100, 200)
+        self.assertEqual(list(range(200)), list(s))
+        executor.shutdown()
+
+    def test_prefetch_invalid_arguments(self):
+        self.assertRaises(ValueError, Stream, prefetch=0)
+        self.assertRaises(ValueError, Stream, executor=object())
+
+class SpillStreamTestCase(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.dir)
+
+    def test_spill_random_access(self):
+        s = Stream(spill=100, spill_dir=self.dir) << iters.range(50000)
+        self.assertEqual(49999, s[-1])
+        self.assertTrue(len(s._collection) < 5000)
+        for i in (0, 1, 16383, 16384, 16385, 40000, 49999):
+            self.assertEqual(i, s[i])
+        self.assertEqual([10, 20000, 39990], list(s[10:50000:19990]))
+
+    def test_spill_iteration(self):
+        s = Stream(spill=10, spill_dir=self.dir) << ({"id": i} for i in range(20000))
+        first, second = iter(s), iter(s)
+        self.assertEqual({"id": 0}, next(first))
+        self.assertEqual(list(range(20000)), [el["id"] for el in second])
+        self.assertEqual(list(range(1, 20000)), [el["id"] for el in first])
+        self.assertEqual(list(range(20000)), [el["id"] for el in s])
+
+    def test_spill_memory_bound(self):
+        s = Stream(spill=100, spill_dir=self.dir) << iters.range(20000)
+        in_memory = 0
+        for _el in s:
+            in_memory = max(in_memory, len(s._collection))
+        self.assertTrue(in_memory <= 2 * 100 + 1024 + 1)
+
+    def test_spill_files_are_removed(self):
+        import os
+        s = Stream(spill=0, spill_dir=self.dir) << iters.range(5000)
+        self.assertEqual(4999, s[4999])
+        self.assertEqual(1, len(os.listdir(self.dir)))
+        del s
+        import gc; gc.collect()
+        self.assertEqual([], os.listdir(self.dir))
+
+    def test_spill_shared_stream(self):
+        s = SharedStream(spill=10, spill_dir=self.dir) << iters.range(3000)
+        self.assertEqual(list(range(3000)), list(s))
+        self.assertEqual(5, s[5])
+
+    def test_spill_invalid_arguments(self):
+        self.assertRaises(ValueError, Stream, spill=-1)
+        self.assertRaises(ValueError, Stream, spill=10, window=10)
+
+class SharedStreamTestCase(unittest.TestCase):
+
+    def _consume_in_threads(self, s, count=8):
+        import threading
+        results = [None] * count
+        def consume(i, it):
+            results[i] = list(it)
+        # iterators are created in advance, so window mode
+        # couldn't release elements before thread is started
+        threads = [threading.Thread(target=consume, args=(i, iter(s))) for i in range(count)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        return results
+
+    def test_fan_out_between_threads(self):
+        pulled = []
+        def source():
+            for i in range(5000):
+                pulled.append(i)
+                yield i
+
+        s = SharedStream() << source
+        for result in self._consume_in_threads(s):
+            self.assertEqual(list(range(5000)), result)
+        # each element was evaluated only once
+        self.assertEqual(list(range(5000)), pulled)
+
+    def test_fan_out_with_window(self):
+        s = SharedStream(window=10) << iters.range(20000)
+        for result in self._consume_in_threads(s):
+            self.assertEqual(list(range(20000)), result)
+
+    def test_stream_api(self):
+        s = SharedStream() << iters.range(10) << [10, 11]
+        self.assertEqual(5, s[5])
+        self.assertEqual(11, s[-1])
+        self.assertEqual([2, 4], list(s[2:6:2]))
+        self.assertTrue(isinstance(s[2:6], SharedStream))
+
+        from operator import add
+        f = SharedStream()
+        fib = f << [0, 1] << iters.map(add, f, iters.drop(1, f))
+        self.assertEqual(6765, fib[20])
+
+class AsyncStreamTestCase(unittest.TestCase):
+    # Note, that tests are written without async/await syntax
+    # to keep this module importable by older Python versions
+
+    def setUp(self):
+        if sys.version_info < (3, 6):
+            self.skipTest("AsyncStream requires Python 3.6+")
+        import asyncio
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        import asyncio
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def _run(self, aw):
+        return self.loop.run_until_complete(aw)
+
+    def _collect(self, s):
+        result, it = [], s.__aiter__()
+        while True:
+            try:
+                result.append(self._run(it.__anext__()))
+            except StopAsyncIteration:
+                return result
+
+    def _source(self, items, delay=0):
+        # async iterator that resolves each element after given delay
+        # and counts calls to __anext__
+        test = self
+        class Source(object):
+            calls = 0
+            def __init__(self):
+                self.items = iter(items)
+            def __aiter__(self):
+                return self
+            def __anext__(self):
+                Source.calls += 1
+                fut = test.loop.create_future()
+                try:
+                    el = next(self.items)
+                except StopIteration:
+                    fut.set_exception(StopAsyncIteration())
+                else:
+                    test.loop.call_later(delay, fut.set_result, el)
+                return fut
+        return Source
+
+    def test_from_async_and_plain_sources(self):
+        from fn import AsyncStream
+        s = AsyncStream(1, 2) << self._source([3, 4])() << [5, 6] << self._source([7])
+        self.assertEqual([1, 2, 3, 4, 5, 6, 7], self._collect(s))
+        self.assertEqual(7, s.cursor())
+        # evaluated elements are memoized
+        self.assertEqual([1, 2, 3, 4, 5, 6, 7], self._collect(s))
+
+    def test_independent_cursors(self):
+        from fn import AsyncStream
+        s = AsyncStream() << iters.range(5)
+        it1, it2 = s.__aiter__(), s.__aiter__()
+        self.assertEqual(0, self._run(it1.__anext__()))
+        self.assertEqual(1, self._run(it1.__anext__()))
+        self.assertEqual(0, self._run(it2.__anext__()))
+
+    def test_get_and_index(self):
+        from fn import AsyncStream
+        s = AsyncStream() << self._source(range(10))()
+        self.assertEqual(3, self._run(s.get(3)))
+        self.assertEqual(4, s.cursor())
+        self.assertEqual(2, self._run(s[2]))
+        self.assertEqual(9, self._run(s[-1]))
+        self.assertRaises(IndexError, self._run, s.get(10))
+        self.assertRaises(TypeError, s.__getitem__, "a")
+
+    def test_concurrent_awaiters_share_evaluation(self):
+        import asyncio
+        from fn import AsyncStream
+        Source = self._source(range(10), delay=0.01)
+        s = AsyncStream() << Source()
+        results = self._run(asyncio.gather(s.get(3), s.get(3), s.get(1), s.get(5)))
+        self.assertEqual([3, 3, 1, 5], results)
+        self.assertEqual(6, Source.calls)
+
+    def test_slicing(self):
+        from fn import AsyncStream
+        s = AsyncStream() << self._source(range(20))()
+        s_slice = s[2:10:3]
+        self.assertEqual(0, s.cursor())
+        self.assertEqual([2, 5, 8], self._collect(s_slice))
+        self.assertEqual([17, 18, 19], self._collect(s[-3:]))
+        self.assertEqual([3, 4], self._collect(s[0:10][3:5]))
+        self.assertRaises(ValueError, s.__getitem__, slice(0, 10, 0))
+
+        # endless source
+        s = AsyncStream() << self._source(itertools.count())()
+        self.assertEqual([5, 4, 3, 2, 1], self._collect(s[5:0:-1]))
+
+class AsyncFTestCase(unittest.TestCase):
+    # Note, that tests are written without async/await syntax
+    # to keep this module importable by older Python versions
+
+    def setUp(self):
+        if sys.version_info < (3, 6):
+            self.skipTest("AsyncF requires Python 3.6+")
+        import asyncio
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.running, self.max_running = 0, 0
+
+    def tearDown(self):
+        import asyncio
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def _run(self, aw):
+        return self.loop.run_until_complete(aw)
+
+    def _delayed(self, f, delay=0.01):
+        # "coroutine function" that resolves f(x) after given delay
+        def call(x):
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            fut = self.loop.create_future()
+            def resolve():
+                self.running -= 1
+                fut.set_result(f(x))
+            self.loop.call_later(delay, resolve)
+            return fut
+        return call
+
+    def test_profile(self):
+        from fn import AsyncF
+
+        pipeline = (AsyncF() >> self._delayed(_ * 2, delay=0.05) >> (_ + 1)).profile()
+        self.assertEqual(11, self._run(pipeline(5)))
+        stats = pipeline.stats()
+        self.assertEqual([1, 1], [s.calls for s in stats])
+        # time of awaited result is measured, not only of creating it
+        self.assertTrue(stats[0].total >= 0.04)
+
+    def test_mixed_stages(self):
+        from fn import AsyncF
+
+        pipeline = AsyncF() >> self._delayed(_ * 2) >> (_ + 1) >> self._delayed(str)
+        self.assertTrue(isinstance(pipeline, AsyncF))
+        self.assertEqual("11", self._run(pipeline(5)))
+        self.assertEqual("11", self._run(pipeline.compile()(5)))
+        self.assertEqual(7, self._run((AsyncF(operator.add, 5) << self._delayed(_ * 2))(1)))
+        self.assertEqual(1, self._run(AsyncF()(1)))
+
+    def test_amap(self):
+        from fn import AsyncF
+        from fn.afunc import amap
+
+        pipeline = AsyncF() >> (amap, self._delayed(_ * 2), 3) >> sum
+        self.assertEqual(90, self._run(pipeline(range(10))))
+        self.assertEqual(3, self.max_running)
+        self.assertEqual(0, self.running)
+        # plain functions and async iterables
+        from fn import AsyncStream
+        self.assertEqual([1, 2], self._run(amap(_ + 1, None, AsyncStream() << [0, 1])))
+
+    def test_amap_error(self):
+        from fn.afunc import amap
+
+        def fail(x):
+            if x == 3: raise ValueError(x)
+            return self._delayed(_ * 2)(x)
+        self.assertRaises(ValueError, self._run, amap(fail, 2, range(10)))
+
+    def test_in_executor(self):
+        import threading
+        from fn import AsyncF
+        from fn.afunc import in_executor
+
+        main = threading.current_thread()
+        pipeline = AsyncF() >> in_executor(lambda x: (x, threading.current_thread() is main))
+        self.assertEqual((1, False), self._run(pipeline(1)))
+
 class OptionTestCase(unittest.TestCase, InstanceChecker):
 
     def test_create_option(self):
@@ -815,6 +1881,9 @@ class OptionTestCase(unittest.TestCase, InstanceChecker):
         self.assertEqual(monad.Empty(), monad.Full(monad.Empty()))
         self.assertEqual("Full(20)", str(monad.Full(monad.Full(20))))
 
+def visit(n):
+    return "function", n
+
 class TrampolineTestCase(unittest.TestCase):
 
     def test_tco_decorator(self):
@@ -857,6 +1926,281 @@ class TrampolineTestCase(unittest.TestCase):
 
         self.assertEqual(5000, recur_inc2(10000))
 
+    def test_tailrec_self_calls(self):
+        limit = sys.getrecursionlimit() * 10
+
+        @recur.tailrec
+        def count(n, acc=0):
+            """Count down to zero"""
+            if n == 0:
+                return acc
+            return count(n - 1, acc=acc + 1)
+
+        @recur.tailrec
+        def fact(n, acc=1):
+            return acc if n <= 1 else fact(n - 1, acc * n)
+
+        self.assertEqual(limit, count(limit))
+        self.assertEqual(120, fact(5))
+        self.assertEqual(fact(1000), fact(999) * 1000)
+        self.assertEqual("count", count.__name__)
+        self.assertEqual("Count down to zero", count.__doc__)
+
+    def test_tailrec_self_calls_semantics(self):
+        @recur.tailrec
+        def last_even(n, acc=0):
+            if n == 0:
+                return acc
+            if n % 2 == 0:
+                even = n
+            # fails on odd n, as without loop
+            return last_even(n - 1, acc + even)
+
+        self.assertEqual(0, last_even(0))
+        self.assertRaises(NameError, last_even, 4)
+
+        order = []
+        def trace(x):
+            order.append(x)
+            return x
+
+        @recur.tailrec
+        def swap(a, b):
+            if a <= 0:
+                return b
+            return swap(b=trace(b + 1), a=trace(a - 1))
+
+        self.assertEqual(2, swap(2, 0))
+        # arguments are evaluated in source order
+        self.assertEqual([1, 1, 2, 0], order)
+
+    def test_tailrec_mutual_recursion(self):
+        limit = sys.getrecursionlimit() * 10
+
+        @recur.tailrec
+        def is_even(n):
+            return True if n == 0 else is_odd(n - 1)
+
+        @recur.tailrec
+        def is_odd(n):
+            if n == 0:
+                return False
+            return is_even(n - 1)
+
+        self.assertTrue(is_even(limit))
+        self.assertFalse(is_odd(limit))
+        # calls to ordinary functions are made as usual
+        @recur.tailrec
+        def total(items, acc=0):
+            return sum([acc]) if not items else total(items[1:], acc + items[0])
+        self.assertEqual(10, total([1, 2, 3, 4]))
+
+    def test_tailrec_methods(self):
+        limit = sys.getrecursionlimit() * 10
+
+        class Counter(object):
+            step = 1
+
+            @recur.tailrec
+            def count(self, n, acc=0):
+                if n == 0:
+                    return acc
+                return self.count(n - 1, acc + self.step)
+
+            @classmethod
+            @recur.tailrec
+            def down(cls, n):
+                return n if n == 0 else cls.down(n - 1)
+
+        self.assertEqual(limit, Counter().count(limit))
+        self.assertEqual(0, Counter.down(limit))
+
+    def test_tailrec_method_calls_global_function(self):
+        class Node(object):
+            @recur.tailrec
+            def visit(self, n):
+                # module level function, not the method itself
+                return visit(n)
+
+        self.assertEqual(("function", 1), Node().visit(1))
+
+    def test_tailrec_frame_dependent_calls(self):
+        @recur.tailrec
+        def scope(n):
+            y = n
+            return locals()
+
+        @recur.tailrec
+        def lookup(n):
+            y = n * 2
+            return eval("y")
+
+        @recur.tailrec
+        def module(n):
+            return globals()
+
+        @recur.tailrec
+        def frame(n):
+            return sys._getframe()
+
+        self.assertEqual({"n": 1, "y": 1}, scope(1))
+        self.assertEqual(4, lookup(2))
+        self.assertTrue(module(1) is globals())
+        self.assertEqual("frame", frame(1).f_code.co_name)
+
+    def test_tailrec_not_tail_calls(self):
+        @recur.tailrec
+        def depth(tree):
+            if not tree:
+                return 0
+            return 1 + max(depth(sub) for sub in tree)
+
+        @recur.tailrec
+        def safe_div(a, b):
+            try:
+                return a // b if b != 0 else safe_div(a, None)
+            except TypeError:
+                return None
+
+        self.assertEqual(2, depth([[[]], []]))
+        self.assertEqual(None, safe_div(1, 0))
+        self.assertEqual(2, safe_div(4, 2))
+
+        def gen(n):
+            yield n
+        self.assertRaises(TypeError, recur.tailrec, gen)
+
+    def test_stackless(self):
+        limit = sys.getrecursionlimit() * 10
+
+        @recur.stackless
+        def depth(tree):
+            depths = []
+            for sub in tree:
+                depths.append((yield depth.call(sub)))
+            yield 1 + max(depths or [0])
+
+        tree = []
+        for _i in range(limit):
+            tree = [tree, []]
+        self.assertEqual(limit + 1, depth(tree))
+        self.assertEqual("depth", depth.__name__)
+
+        @recur.stackless
+        def is_even(n):
+            yield True if n == 0 else (yield is_odd.call(n - 1))
+
+        @recur.stackless
+        def is_odd(n):
+            yield False if n == 0 else (yield is_even.call(n - 1))
+
+        self.assertTrue(is_even(limit))
+
+    def test_stackless_plain_calls(self):
+        @recur.stackless
+        def square(n):
+            yield n * n
+
+        def helper(n):
+            return square(n) + 1
+
+        @recur.stackless
+        def total(n):
+            if n == 0:
+                yield 0
+            else:
+                # plain call is evaluated at once even inside of evaluation
+                yield helper(n) + (yield total.call(n - 1))
+
+        self.assertEqual(5, helper(2))
+        self.assertEqual(17, total(3))
+
+        class Tree(object):
+            def __init__(self, *children):
+                self.children = children
+
+            @recur.stackless
+            def size(self):
+                sizes = []
+                for sub in self.children:
+                    sizes.append((yield sub.size.call()))
+                yield 1 + sum(sizes)
+
+        self.assertEqual(4, Tree(Tree(), Tree(Tree())).size())
+
+    def test_stackless_memoize(self):
+        from fn.func import LRU
+
+        calls = []
+        @recur.stackless(memoize=True)
+        def fib(n):
+            calls.append(n)
+            if n < 2:
+                yield n
+            else:
+                yield (yield fib.call(n - 1)) + (yield fib.call(n - 2))
+
+        self.assertEqual(354224848179261915075, fib(100))
+        self.assertEqual(101, len(calls))
+
+        @recur.stackless(memoize=LRU(10))
+        def paths(x, y):
+            if x == 0 or y == 0:
+                yield 1
+            else:
+                yield (yield paths.call(x - 1, y)) + (yield paths.call(x, y - 1))
+        self.assertEqual(184756, paths(10, 10))
+
+    def test_stackless_memoize_threads(self):
+        from threading import Thread
+        from fn.func import LRU
+
+        policy = LRU(20)
+        @recur.stackless(memoize=policy)
+        def paths(x, y):
+            if x == 0 or y == 0:
+                yield 1
+            else:
+                yield (yield paths.call(x - 1, y)) + (yield paths.call(x, y - 1))
+
+        results = []
+        threads = [Thread(target=lambda: results.append(paths(9, 9))) for _i in range(8)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        self.assertEqual([48620] * 8, results)
+        self.assertEqual(len(policy), policy.total)
+        self.assertTrue(len(policy) <= 20)
+
+    def test_stackless_errors(self):
+        @recur.stackless
+        def fail(n):
+            if n == 0:
+                raise ValueError(n)
+            yield (yield fail.call(n - 1))
+
+        @recur.stackless
+        def recover(n):
+            try:
+                yield (yield fail.call(n))
+            except ValueError:
+                yield -1
+
+        self.assertRaises(ValueError, fail, 1000)
+        self.assertEqual(-1, recover(1000))
+
+    def test_stackless_return(self):
+        if sys.version_info[0] == 2:
+            self.skipTest("generators can't return values in Python 2")
+        namespace = {"recur": recur}
+        exec("""
+@recur.stackless
+def total(items):
+    if not items:
+        return 0
+    return items[0] + (yield total.call(items[1:]))
+""", namespace)
+        self.assertEqual(10, namespace["total"]([1, 2, 3, 4]))
+
 class UnionBasedHeapsTestCase(unittest.TestCase):
 
     def _heap_basic_operations(self, cls):
@@ -919,6 +2263,133 @@ class UnionBasedHeapsTestCase(unittest.TestCase):
         # Convert to list using iterator
         self.assertEqual([(40,-10), (10,10), (30,15), (50,100), (20,110)], list(h))
 
+    def test_skew_heap_deep_union(self):
+        # 1M elements on right spines should be merged without
+        # hitting recursion limit
+        evens, odds = SkewHeap(), SkewHeap()
+        for i in range(10**6 - 2, -1, -2):
+            evens = SkewHeap(i, None, evens)
+            odds = SkewHeap(i + 1, None, odds)
+
+        h = evens.union(odds)
+        for expected in range(5):
+            el, h = h.extract()
+            self.assertEqual(expected, el)
+
+    def test_pairing_heap_long_subheaps_list(self):
+        # 1M subheaps in the list should be paired without
+        # hitting recursion limit
+        subs = None
+        for i in range(10**6 - 1, -1, -1):
+            subs = (PairingHeap(i), subs)
+
+        el, h = PairingHeap(-1, subs).extract()
+        self.assertEqual(-1, el)
+        for expected in range(5):
+            el, h = h.extract()
+            self.assertEqual(expected, el)
+
+    def _heap_random_ordering(self, cls):
+        import random
+        data = [random.randint(0, 1000) for _ in range(5000)]
+        h = cls()
+        for el in data:
+            h = h.insert(el)
+        self.assertEqual(sorted(data), list(h))
+
+    def _heap_from_iterable(self, cls):
+        import random
+        data = [random.randint(0, 1000) for _ in range(5000)]
+        self.assertEqual(sorted(data), list(cls.from_iterable(data)))
+        self.assertEqual(sorted(data, reverse=True),
+                         list(cls.from_iterable(data, key=operator.neg)))
+        self.assertEqual([], list(cls.from_iterable([])))
+
+        h = cls.from_iterable([], cmp=lambda a,b: len(a) - len(b))
+        h = h.insert("few words").insert("give").insert("about")
+        self.assertEqual(["give", "about", "few words"], list(h))
+
+    def _heap_merge_all(self, cls):
+        h = cls.merge_all([cls.from_iterable([5, 1, 9]),
+                           cls(),
+                           cls.from_iterable([4, 8]),
+                           cls(3)])
+        self.assertEqual([1, 3, 4, 5, 8, 9], list(h))
+        self.assertFalse(cls.merge_all([]))
+        self.assertFalse(cls.merge_all([cls(), cls()]))
+        # ordering of empty heaps is kept
+        h = cls.merge_all([cls(key=operator.neg), cls(key=operator.neg)])
+        self.assertEqual([2, 1], list(h.insert(1).insert(2)))
+
+    def _heap_sorted_drain(self, cls):
+        h = cls.from_iterable([50, 10, 40, 20, 30])
+        self.assertEqual([10, 20, 30, 40, 50], h.to_sorted_list())
+        self.assertEqual([10, 20], h.nsmallest(2))
+        self.assertEqual([10, 20, 30, 40, 50], h.nsmallest(10))
+        self.assertEqual([], h.nsmallest(0))
+        self.assertEqual([], cls().to_sorted_list())
+        # drain should not change original heap
+        self.assertEqual(10, h.extract()[0])
+
+    def test_skew_heap_from_iterable(self):
+        self._heap_from_iterable(SkewHeap)
+
+    def test_pairing_heap_from_iterable(self):
+        self._heap_from_iterable(PairingHeap)
+
+    def test_skew_heap_merge_all(self):
+        self._heap_merge_all(SkewHeap)
+
+    def test_pairing_heap_merge_all(self):
+        self._heap_merge_all(PairingHeap)
+
+    def test_skew_heap_sorted_drain(self):
+        self._heap_sorted_drain(SkewHeap)
+
+    def test_pairing_heap_sorted_drain(self):
+        self._heap_sorted_drain(PairingHeap)
+
+    def _heap_key_computed_once(self, cls):
+        calls = []
+        def key(el):
+            calls.append(el)
+            return -el
+
+        h = cls(key=key)
+        for el in range(100):
+            h = h.insert(el)
+        self.assertEqual(list(range(99, -1, -1)), list(h))
+        self.assertEqual(100, len(calls))
+
+        del calls[:]
+        self.assertEqual([2, 1, 0], list(cls.from_iterable(range(3), key=key)))
+        self.assertEqual(3, len(calls))
+
+    def _heap_shared_ordering(self, cls):
+        h = cls(key=operator.neg).insert(1).insert(2).insert(3)
+        _, tail = h.extract()
+        self.assertTrue(h._ordering is tail._ordering)
+        self.assertTrue(cls(1)._ordering is cls(2)._ordering)
+        self.assertEqual(operator.neg, h.keyfn)
+
+    def test_skew_heap_key_computed_once(self):
+        self._heap_key_computed_once(SkewHeap)
+
+    def test_pairing_heap_key_computed_once(self):
+        self._heap_key_computed_once(PairingHeap)
+
+    def test_skew_heap_shared_ordering(self):
+        self._heap_shared_ordering(SkewHeap)
+
+    def test_pairing_heap_shared_ordering(self):
+        self._heap_shared_ordering(PairingHeap)
+
+    def test_skew_heap_random_ordering(self):
+        self._heap_random_ordering(SkewHeap)
+
+    def test_pairing_heap_random_ordering(self):
+        self._heap_random_ordering(PairingHeap)
+
     def test_skew_heap_basic(self):
         self._heap_basic_operations(SkewHeap)
 